@@ -1,5 +1,7 @@
 import argparse
 import dmtest.bufio.bufio_tests as bufio
+import dmtest.command_trace as command_trace
+import dmtest.config as config
 import dmtest.db as db
 import dmtest.fixture
 import dmtest.test_register as test_register
@@ -10,18 +12,25 @@ import dmtest.thin.register as thin_register
 import dmtest.thin_migrate.register as thin_migrate_register
 import dmtest.vdo.register as vdo_register
 import dmtest.dependency_tracker as dep
+import dmtest.geometry as geometry
+import dmtest.kmsg as kmsg
+import dmtest.parallel as parallel
+import dmtest.process as process
+import dmtest.regression as regression
+import dmtest.scheduler as scheduler
 import dmtest.test_filter as filter
-from dmtest.utils import get_dmesg_log
 import io
 import itertools
 import logging as log
 import os
+import signal
 import sys
 import time
 import traceback
 import subprocess
 import shutil
-from typing import Optional, NamedTuple, Sequence
+from contextlib import contextmanager
+from typing import List, Optional, NamedTuple, Sequence, Tuple
 
 
 class TreeFormatter:
@@ -123,7 +132,7 @@ class AvgResult(NamedTuple):
     duration: float
 
 
-def average_results(res_list: Sequence[db.TestResult]) -> Optional[AvgResult]:
+def average_results(res_list: Sequence[db.TestSummary]) -> Optional[AvgResult]:
     if len(res_list) == 0:
         return None
 
@@ -160,7 +169,8 @@ def average_results(res_list: Sequence[db.TestResult]) -> Optional[AvgResult]:
 def cmd_list(tests: test_register.TestRegister, args, results: db.TestResults):
     result_set = get_result_set(args)
     filter = build_filter(args)
-    paths = sorted(tests.paths(results, result_set, filter))
+    summaries = results.get_result_set_summaries(result_set)
+    paths = sorted(tests.paths(results, result_set, filter, summaries))
     formatter = TreeFormatter()
 
     if len(paths) == 0:
@@ -168,7 +178,11 @@ def cmd_list(tests: test_register.TestRegister, args, results: db.TestResults):
 
     for p in paths:
         print(f"{formatter.tree_line(p)}", end=" ")
-        result = average_results(results.get_test_results(p, result_set, args.run_nr))
+        res_list = [
+            r for r in summaries.get(p, [])
+            if args.run_nr is None or r.run_nr == args.run_nr
+        ]
+        result = average_results(res_list)
         if result is None:
             print("-")
         elif result.nr_runs == 1:
@@ -213,29 +227,71 @@ def cmd_log(tests: test_register.TestRegister, args, results: db.TestResults):
 # -----------------------------------------
 # 'compare' command
 
-def can_compare_times(old: Optional[AvgResult], new: Optional[AvgResult]) -> bool:
-    if old is None or new is None:
-        return False
+def can_compare_times(old: AvgResult, new: AvgResult) -> bool:
     if old.nr_pass != 0 and new.nr_pass != 0:
         return True
     return old.pass_fail and old.pass_fail == new.pass_fail
 
 
+def durations_to_compare(res_list: Sequence[db.TestSummary], passes_only: bool) -> List[float]:
+    return [r.duration for r in res_list if not passes_only or r.pass_fail == "PASS"]
+
+
+def significance(c: regression.Comparison, higher_is_better: bool) -> str:
+    if c.p_value >= 1.0:
+        # too few runs to test
+        return ""
+
+    s = f" p={c.p_value:.3f}"
+    if c.significant:
+        if (c.diff > 0) == higher_is_better:
+            s += " IMPROVED"
+        else:
+            s += " REGRESSION"
+    return s
+
+
+def compare_metrics(old: Sequence[db.MetricResult], new: Sequence[db.MetricResult], alpha: float):
+    old_values = {}
+    for m in old:
+        old_values.setdefault(m.name, []).append(m.value)
+
+    new_values = {}
+    units = {}
+    for m in new:
+        new_values.setdefault(m.name, []).append(m.value)
+        units[m.name] = m.unit
+
+    for name, values in new_values.items():
+        if name not in old_values:
+            continue
+        c = regression.compare(old_values[name], values, alpha)
+        unit = units[name]
+        sig = significance(c, regression.higher_is_better(unit))
+        print(
+            f"{''.ljust(50,' ')} {name}: {c.old:.2f} => {c.new:.2f} {unit} [{c.percent:+.0f}%{sig}]"
+        )
+
+
 def cmd_compare(tests: test_register.TestRegister, args, results: db.TestResults):
     if not args.old_result_set:
         print("Missing old result set.", file=sys.stderr)
         sys.exit(1)
     new_set = get_result_set(args)
     filter = build_filter(args)
-    paths = sorted(tests.paths(results, new_set, filter))
+    old_summaries = results.get_result_set_summaries(args.old_result_set)
+    new_summaries = results.get_result_set_summaries(new_set)
+    paths = sorted(tests.paths(results, new_set, filter, new_summaries))
+    old_metrics = results.get_result_set_metrics(args.old_result_set)
+    new_metrics = results.get_result_set_metrics(new_set)
     formatter = TreeFormatter()
 
     if len(paths) == 0:
         print("No matching tests found.")
 
     for p in paths:
-        old_result = average_results(results.get_test_results(p, args.old_result_set))
-        new_result = average_results(results.get_test_results(p, new_set))
+        old_result = average_results(old_summaries.get(p, []))
+        new_result = average_results(new_summaries.get(p, []))
         print(f"{formatter.tree_line(p)}", end=" ")
         if old_result:
             if old_result.pass_fail:
@@ -251,12 +307,23 @@ def cmd_compare(tests: test_register.TestRegister, args, results: db.TestResults
                 print(f"{new_result.nr_pass / new_result.nr_runs * 100:.0f}% PASS ", end="")
         else:
             print("- ", end="")
-        if can_compare_times(old_result, new_result):
-            diff = new_result.duration - old_result.duration
-            print(f"[{diff * 100 / old_result.duration:+.0f}% {diff:+.2f}s]")
+        if (
+            old_result is not None
+            and new_result is not None
+            and can_compare_times(old_result, new_result)
+        ):
+            passes_only = old_result.nr_pass != 0 and new_result.nr_pass != 0
+            c = regression.compare(
+                durations_to_compare(old_summaries[p], passes_only),
+                durations_to_compare(new_summaries[p], passes_only),
+                args.alpha,
+            )
+            print(f"[{c.percent:+.0f}% {c.diff:+.2f}s{significance(c, False)}]")
         else:
             print("")
 
+        compare_metrics(old_metrics.get(p, []), new_metrics.get(p, []), args.alpha)
+
 
 # -----------------------------------------
 # 'list-runs' command
@@ -264,7 +331,8 @@ def cmd_compare(tests: test_register.TestRegister, args, results: db.TestResults
 def cmd_list_runs(tests: test_register.TestRegister, args, results: db.TestResults):
     result_set = get_result_set(args)
     filter = build_filter(args)
-    paths = sorted(tests.paths(results, result_set, filter))
+    summaries = results.get_result_set_summaries(result_set)
+    paths = sorted(tests.paths(results, result_set, filter, summaries))
     formatter = TreeFormatter()
 
     if len(paths) == 0:
@@ -272,7 +340,7 @@ def cmd_list_runs(tests: test_register.TestRegister, args, results: db.TestResul
 
     for p in paths:
         found = False
-        res_list = results.get_test_results(p, result_set)
+        res_list = summaries.get(p, [])
         print(f"{formatter.tree_line(p)}", end=" ")
         for result in res_list:
             if args.run_state and result.pass_fail.lower() != args.run_state.lower():
@@ -286,6 +354,117 @@ def cmd_list_runs(tests: test_register.TestRegister, args, results: db.TestResul
             print("-")
 
 
+# -----------------------------------------
+# 'metrics' command
+
+def cmd_metrics(tests: test_register.TestRegister, args, results: db.TestResults):
+    result_set = get_result_set(args)
+    filter = build_filter(args)
+    paths = sorted(tests.paths(results, result_set, filter))
+    metrics = results.get_result_set_metrics(result_set)
+    formatter = TreeFormatter()
+
+    if len(paths) == 0:
+        print("No matching tests found.")
+
+    for p in paths:
+        # group by metric name, preserving the order they were recorded in
+        by_name = {}
+        for m in metrics.get(p, []):
+            if args.run_nr is None or m.run_nr == args.run_nr:
+                by_name.setdefault(m.name, []).append(m)
+
+        print(f"{formatter.tree_line(p)}", end=" ")
+        if not by_name:
+            print("-")
+            continue
+
+        for i, (name, ms) in enumerate(by_name.items()):
+            if i > 0:
+                print(f"{''.ljust(50,' ')}", end="")
+            mean = sum(m.value for m in ms) / len(ms)
+            runs = f" (mean of {len(ms)} runs)" if len(ms) > 1 else ""
+            print(f"{name}: {mean:.2f} {ms[0].unit}".rstrip() + runs)
+
+
+# -----------------------------------------
+# 'series' command
+
+
+def cmd_series(tests: test_register.TestRegister, args, results: db.TestResults):
+    result_set = get_result_set(args)
+    filter = build_filter(args)
+    paths = sorted(tests.paths(results, result_set, filter))
+    series = results.get_result_set_series(result_set)
+    formatter = TreeFormatter()
+
+    if len(paths) == 0:
+        print("No matching tests found.")
+
+    for p in paths:
+        ss = [
+            r
+            for r in series.get(p, [])
+            if (args.run_nr is None or r.run_nr == args.run_nr)
+            and (args.name is None or r.series.name == args.name)
+        ]
+
+        print(f"{formatter.tree_line(p)}", end=" ")
+        if not ss:
+            print("-")
+            continue
+
+        for i, r in enumerate(ss):
+            s = r.series
+            if i > 0:
+                print(f"{''.ljust(50,' ')}", end="")
+            if not s.values:
+                print(f"{s.name}: no samples")
+                continue
+            summary = (
+                f"{s.name} (run {r.run_nr}): {len(s.values)} samples, "
+                f"min {min(s.values):g}, max {max(s.values):g}, "
+                f"last {s.values[-1]:g} {s.unit}"
+            )
+            print(summary.rstrip())
+            if args.name is not None:
+                for t, v in zip(s.times, s.values):
+                    print(f"  {t:10.3f} {v:g}")
+
+
+# -----------------------------------------
+# 'commands' command
+
+
+def cmd_commands(tests: test_register.TestRegister, args, results: db.TestResults):
+    result_set = get_result_set(args)
+    filter = build_filter(args)
+    paths = sorted(tests.paths(results, result_set, filter))
+    commands = results.get_result_set_commands(result_set)
+    formatter = TreeFormatter()
+
+    if len(paths) == 0:
+        print("No matching tests found.")
+
+    for p in paths:
+        records = [
+            c
+            for r in commands.get(p, [])
+            if args.run_nr is None or r.run_nr == args.run_nr
+            for c in r.commands
+        ]
+
+        print(f"{formatter.tree_line(p)}", end=" ")
+        if not records:
+            print("-")
+            continue
+
+        for i, s in enumerate(command_trace.summarise(records)):
+            if i > 0:
+                print(f"{''.ljust(50,' ')}", end="")
+            print(command_trace.format_summary(s))
+
+
 # -----------------------------------------
 # 'run' command
 
@@ -302,6 +481,183 @@ class StringIOWithStderr(io.StringIO):
         sys.stderr.write(s)
 
 
+# Seconds a test may run for before it's aborted, unless overridden by the
+# config or command line.
+DEFAULT_TEST_TIMEOUT = 6 * 60 * 60
+
+
+class TestTimeout(BaseException):
+    """
+    Derived from BaseException, like kmsg.KernelOops, so tests that catch
+    Exception don't swallow it.
+    """
+
+    pass
+
+
+@contextmanager
+def abort_after(seconds: Optional[float]):
+    """
+    Raises TestTimeout in the main thread if the body runs for more than
+    'seconds'.  Only raised once, so teardown isn't interrupted too.
+    """
+    if not seconds:
+        yield
+        return
+
+    state = {"armed": True}
+
+    def handler(_signum, _frame):
+        if state["armed"]:
+            state["armed"] = False
+            raise TestTimeout(f"test timed out after {seconds}s")
+
+    old_handler = signal.signal(signal.SIGALRM, handler)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        state["armed"] = False
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, old_handler)
+
+
+# Config values, or command line options, of 0 disable the timeout.
+def get_timeout(args, cfg, name: str, default: float) -> Optional[float]:
+    value = getattr(args, name)
+    if value is None:
+        value = cfg.get(name, default)
+    return value or None
+
+
+class RunOutcome(NamedTuple):
+    result: db.TestResult
+    summary: str
+    exit_code: int
+    deps: Optional[Tuple[List[str], List[str]]]
+
+
+def run_test(
+    tests: test_register.TestRegister,
+    test_deps: dep.TestDeps,
+    buffer: io.StringIO,
+    klog,
+    p: str,
+    fix: dmtest.fixture.Fixture,
+    result_set: str,
+    run_nr: int,
+    test_timeout: Optional[float] = None,
+    shared_kernel_log: bool = False,
+) -> RunOutcome:
+    """
+    'shared_kernel_log' is set when other tests are running alongside this
+    one.  An oops can't then be pinned on this test, so although it is
+    still aborted, it's marked TAINTED rather than FAIL.
+    """
+    buffer.seek(0)
+    buffer.truncate()
+
+    log.info(f"Running '{p}'")
+
+    # devices may have been removed, and their numbers reused, without
+    # going through dmdev.Dev
+    geometry.clear()
+
+    exit_code = 0
+    passed = True
+    timed_out = False
+    tainted = False
+    missing_dep = None
+    deps = None
+    mark = klog.mark()
+    trace = None
+    start = time.time()
+    try:
+        with klog.abort_on_oops(mark), abort_after(test_timeout), \
+                dep.dep_tracker() as tracker, \
+                command_trace.command_trace() as trace:
+            old_deps = test_deps.get_deps(p)
+            tests.check_deps(old_deps)
+            tests.run(p, fix)
+            deps = (tracker.executables, tracker.targets)
+
+    except test_register.MissingTestDep as e:
+        missing_dep = e
+
+    except kmsg.KernelOops as e:
+        passed = False
+        tainted = shared_kernel_log
+        exit_code = 2
+        log.error(f"Test aborted: {e}")
+
+    except (TestTimeout, process.CommandTimeout) as e:
+        passed = False
+        timed_out = True
+        exit_code = 1
+        log.error(f"Test aborted: {e}")
+
+    except Exception as e:
+        passed = False
+        exit_code = 1
+        if bool(os.getenv("DMTEST_PY_VERBOSE_TB", False)):
+            log.error(f"Exception caught: \n{traceback.format_exc()}\n")
+        else:
+            log.error(f"Exception caught: {e}")
+        while e.__cause__ or e.__context__:
+            if e.__cause__:
+                e = e.__cause__
+            else:
+                e = e.__context__
+            log.error(f"Triggered while handling Exception: {e}")
+    elapsed = time.time() - start
+
+    commands = trace.records if trace else []
+    for s in command_trace.summarise(commands):
+        log.info(command_trace.format_summary(s))
+
+    dmesg_log = klog.text_since(mark)
+    if klog.bug_since(mark):
+        log.error("Oops in kernel log, see dmesg for more info")
+        if shared_kernel_log:
+            tainted = tainted or passed
+        else:
+            passed = False
+        exit_code = 2
+
+    pass_str = None
+    if missing_dep:
+        log.info(f"Missing dependency: {missing_dep}")
+        summary = f"MISSING_DEP [{missing_dep}]"
+        pass_str = "MISSING_DEP"
+    elif tainted:
+        summary = f"TAINTED [{elapsed:.2f}s] (kernel oops during a parallel run)"
+        pass_str = "TAINTED"
+    elif passed:
+        summary = f"PASS [{elapsed:.2f}s]"
+        pass_str = "PASS"
+    elif timed_out:
+        summary = f"TIMEOUT [{elapsed:.2f}s]"
+        pass_str = "TIMEOUT"
+    else:
+        summary = "FAIL"
+        pass_str = "FAIL"
+
+    test_log = buffer.getvalue()
+    result = db.TestResult(
+        p,
+        pass_str,
+        test_log,
+        dmesg_log,
+        result_set,
+        elapsed,
+        run_nr,
+        fix.metrics,
+        fix.series,
+        commands,
+    )
+    return RunOutcome(result, summary, exit_code, deps)
+
+
 def cmd_run(tests: test_register.TestRegister, args, results: db.TestResults):
 
     exit_code = 0
@@ -314,6 +670,10 @@ def cmd_run(tests: test_register.TestRegister, args, results: db.TestResults):
         print("--nr-runs must be at least 1")
         return
 
+    if args.jobs < 1:
+        print("--jobs must be at least 1")
+        return
+
     # select tests
     filter = build_filter(args)
     paths = sorted(tests.paths(results, result_set, filter))
@@ -321,6 +681,19 @@ def cmd_run(tests: test_register.TestRegister, args, results: db.TestResults):
     if len(paths) == 0:
         print("No matching tests found.")
 
+    if args.schedule == "duration":
+        estimates = scheduler.estimate_durations(results.get_durations(), paths)
+    else:
+        estimates = {}
+    failed = results.get_failed_tests(result_set) if args.failed_first else set()
+    paths = scheduler.order_paths(paths, estimates, failed)
+
+    cfg = config.read_config()
+    process.set_default_timeout(
+        get_timeout(args, cfg, "command_timeout", process.DEFAULT_TIMEOUT)
+    )
+    test_timeout = get_timeout(args, cfg, "test_timeout", DEFAULT_TEST_TIMEOUT)
+
     # Set up the logging
     if args.log:
         buffer = StringIOWithStderr()
@@ -333,73 +706,128 @@ def cmd_run(tests: test_register.TestRegister, args, results: db.TestResults):
         stream=buffer,
     )
 
+    if args.jobs > 1:
+        # each worker opens its own kernel log reader
+        exit_code = run_jobs(
+            tests,
+            args,
+            results,
+            test_deps,
+            buffer,
+            result_set,
+            paths,
+            estimates,
+            cfg,
+            test_timeout,
+        )
+        dep.write_test_deps(test_dep_path, test_deps)
+        os._exit(exit_code)
+
+    klog = kmsg.kernel_log()
+
     for run_nr in range(args.nr_runs):
         formatter = TreeFormatter()
         if args.nr_runs > 1:
             print(f"*** Run: {run_nr} ***")
         for p in paths:
-            buffer.seek(0)
-            buffer.truncate()
-
             print(f"{formatter.tree_line(p)}", end=" ", flush=True)
-            log.info(f"Running '{p}'")
-
-            fix = dmtest.fixture.Fixture()
-            passed = True
-            missing_dep = None
-            start = time.time()
-            try:
-                with dep.dep_tracker() as tracker:
-                    old_deps = test_deps.get_deps(p)
-                    tests.check_deps(old_deps)
-                    tests.run(p, fix)
-                    exes = tracker.executables
-                    targets = tracker.targets
-                    test_deps.set_deps(p, exes, targets)
-
-            except test_register.MissingTestDep as e:
-                missing_dep = e
-
-            except Exception as e:
-                passed = False
-                exit_code = 1
-                if bool(os.getenv("DMTEST_PY_VERBOSE_TB", False)):
-                    log.error(f"Exception caught: \n{traceback.format_exc()}\n")
-                else:
-                    log.error(f"Exception caught: {e}")
-                while e.__cause__ or e.__context__:
-                    if e.__cause__:
-                        e = e.__cause__
-                    else:
-                        e = e.__context__
-                    log.error(f"Triggered while handling Exception: {e}")
-            elapsed = time.time() - start
-
-            dmesg_log = get_dmesg_log(start)
-            if "BUG" in dmesg_log:
-                log.error("BUG in kernel log, see dmesg for more info")
-                passed = False
-                exit_code = 2
-
-            pass_str = None
-            if missing_dep:
-                log.info(f"Missing dependency: {missing_dep}")
-                print(f"MISSING_DEP [{missing_dep}]")
-                pass_str = "MISSING_DEP"
-            elif passed:
-                print(f"PASS [{elapsed:.2f}s]")
-                pass_str = "PASS"
-            else:
-                print("FAIL")
-                pass_str = "FAIL"
 
-            test_log = buffer.getvalue()
-            result = db.TestResult(p, pass_str, test_log, dmesg_log, result_set, elapsed, run_nr)
-            results.insert_test_result(result, with_delete=(run_nr == 0))
+            fix = dmtest.fixture.Fixture(cfg)
+            outcome = run_test(
+                tests, test_deps, buffer, klog, p, fix, result_set, run_nr, test_timeout
+            )
+            print(outcome.summary)
+
+            if outcome.exit_code:
+                exit_code = outcome.exit_code
+            if outcome.deps:
+                test_deps.set_deps(p, *outcome.deps)
+            results.insert_test_result(outcome.result, with_delete=(run_nr == 0))
 
     dep.write_test_deps(test_dep_path, test_deps)
     os._exit(exit_code)
 
+
+def run_jobs(
+    tests,
+    args,
+    results,
+    test_deps,
+    buffer,
+    result_set,
+    paths,
+    estimates,
+    cfg,
+    test_timeout,
+) -> int:
+    """
+    Runs the selected tests across 'args.jobs' worker processes, each with
+    its own slice of the test devices.  Results are written to the database
+    as they arrive.
+    """
+    exit_code = 0
+
+    # Runs of the same test may complete out of order, so rather than
+    # relying on run 0 to clear out old results, the first result in for
+    # each test does it.
+    seen = set()
+
+    # Set in each worker, after the fork, since the reader thread wouldn't
+    # survive it.
+    klog = None
+
+    def run_fn(task, cfg):
+        nonlocal klog
+        if klog is None:
+            klog = kmsg.kernel_log()
+
+        fix = dmtest.fixture.Fixture(cfg)
+        return run_test(
+            tests,
+            test_deps,
+            buffer,
+            klog,
+            task.path,
+            fix,
+            result_set,
+            task.run_nr,
+            test_timeout,
+            shared_kernel_log=True,
+        )
+
+    def on_result(outcome):
+        nonlocal exit_code
+        r = outcome.result
+        run_str = f" (run {r.run_nr})" if args.nr_runs > 1 else ""
+        print(f"{r.test_name}{run_str} {outcome.summary}", flush=True)
+
+        if outcome.exit_code:
+            exit_code = max(exit_code, outcome.exit_code)
+        if outcome.deps:
+            test_deps.set_deps(r.test_name, *outcome.deps)
+        results.insert_test_result(r, with_delete=(r.test_name not in seen))
+        seen.add(r.test_name)
+
+    if estimates:
+        # keep 'paths' order across all the runs, so the longest tests
+        # are started first.
+        tasks = [
+            parallel.Task(p, run_nr) for p in paths for run_nr in range(args.nr_runs)
+        ]
+        makespan = scheduler.predicted_makespan(
+            [estimates[t.path] for t in tasks], args.jobs
+        )
+        print(f"Estimated wall time: {makespan:.0f}s")
+    else:
+        tasks = [
+            parallel.Task(p, run_nr) for run_nr in range(args.nr_runs) for p in paths
+        ]
+
+    with parallel.partition_devices(cfg, args.jobs) as cfgs:
+        parallel.run_parallel(tasks, cfgs, run_fn, on_result)
+
+    return exit_code
+
 # -----------------------------------------
 # 'health' command
 
@@ -565,6 +993,38 @@ def command_line_parser():
         help="Print the log to stdout",
         action="store_true",
     )
+    run_p.add_argument(
+        "--jobs",
+        metavar="NR_JOBS",
+        type=int,
+        default=1,
+        help="Run tests in parallel, splitting the test devices between NR_JOBS workers",
+    )
+    run_p.add_argument(
+        "--schedule",
+        choices=["name", "duration"],
+        default="name",
+        help="Run tests in name order, or longest first based on previous durations",
+    )
+    run_p.add_argument(
+        "--failed-first",
+        help="Run tests that failed last time in this result set first",
+        action="store_true",
+    )
+    run_p.add_argument(
+        "--command-timeout",
+        metavar="SECONDS",
+        type=float,
+        help="Kill commands that run for longer than this; 0 for no limit "
+        f"(default: 'command_timeout' in config.toml, or {process.DEFAULT_TIMEOUT}s)",
+    )
+    run_p.add_argument(
+        "--test-timeout",
+        metavar="SECONDS",
+        type=float,
+        help="Abort tests that run for longer than this; 0 for no limit "
+        f"(default: 'test_timeout' in config.toml, or {DEFAULT_TEST_TIMEOUT}s)",
+    )
 
     compare_p = subparsers.add_parser("compare", help="compare two result sets")
     compare_p.set_defaults(func=cmd_compare)
@@ -575,8 +1035,43 @@ def command_line_parser():
         type=str,
         help="Old result set to compare against",
     )
+    compare_p.add_argument(
+        "--alpha",
+        metavar="ALPHA",
+        type=float,
+        default=0.05,
+        help="Significance level for flagging a change as a regression; needs at least 4 runs in each result set",
+    )
     arg_result_set(compare_p)
 
+    metrics_p = subparsers.add_parser("metrics", help="list benchmark metrics")
+    metrics_p.set_defaults(func=cmd_metrics)
+    arg_filter(metrics_p)
+    arg_result_set(metrics_p)
+    arg_run_nr(metrics_p)
+
+    series_p = subparsers.add_parser(
+        "series", help="list values sampled over the course of tests"
+    )
+    series_p.set_defaults(func=cmd_series)
+    arg_filter(series_p)
+    arg_result_set(series_p)
+    arg_run_nr(series_p)
+    series_p.add_argument(
+        "--name",
+        metavar="SERIES",
+        type=str,
+        help="Only show the named series, printing every sample",
+    )
+
+    commands_p = subparsers.add_parser(
+        "commands", help="summarise the external commands run by tests"
+    )
+    commands_p.set_defaults(func=cmd_commands)
+    arg_filter(commands_p)
+    arg_result_set(commands_p)
+    arg_run_nr(commands_p)
+
     list_runs_p = subparsers.add_parser("list-runs", help="list each test run individually")
     list_runs_p.set_defaults(func=cmd_list_runs)
     arg_filter(list_runs_p)
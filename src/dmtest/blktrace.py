@@ -1,4 +1,5 @@
 import logging as log
+import os
 import re
 import subprocess
 import time
@@ -33,9 +34,21 @@ def parse_events(txt: str, complete: bool):
     return events
 
 
+# How long blktrace gets to start tracing before we give up on it.
+START_TIMEOUT = 10.0
+
+
+def _tracing(dev) -> bool:
+    st = os.stat(dev)
+    path = f"/sys/dev/block/{os.major(st.st_rdev)}:{os.minor(st.st_rdev)}/trace/enable"
+    with open(path) as f:
+        return f.read().strip() == "1"
+
+
 class BlkTrace:
     def __init__(self, devs: List[str], complete=False):
         self._complete = complete
+        self._devs = devs
 
         blktrace_cmd = ["blktrace", "-o", "-"]
 
@@ -77,8 +90,24 @@ class BlkTrace:
         self._blktrace.terminate()
         self._blktrace.wait()
 
+    def _wait_until_tracing(self):
+        # blktrace takes a moment to set up, and any io before then is missed
+        deadline = time.monotonic() + START_TIMEOUT
+        while not all(_tracing(dev) for dev in self._devs):
+            if self._blktrace.poll() is not None:
+                raise RuntimeError("blktrace exited before tracing started")
+            if time.monotonic() > deadline:
+                raise RuntimeError("timed out waiting for blktrace to start")
+            time.sleep(0.01)
+
     def __enter__(self):
-        time.sleep(1)  # why do we need this?  udev again?
+        try:
+            self._wait_until_tracing()
+        except BaseException:
+            self.stop_blktrace()
+            self._blkparse.kill()
+            self._blkparse.wait()
+            raise
         return self
 
     def __exit__(self, _exc_type, _exc_value, _traceback):
@@ -1,6 +1,7 @@
 import dmtest.device_mapper.dev as dmdev
 import dmtest.device_mapper.table as table
 import dmtest.device_mapper.targets as targets
+import dmtest.sampler as sampler
 import dmtest.tvm as tvm
 import dmtest.units as units
 import dmtest.utils as utils
@@ -235,15 +236,10 @@ class BufioParams:
         write_sys_param("max_age_seconds", str(value))
 
 
+# Sets the bufio params, and samples them while the test runs.  The
+# samples are stored with the test result if a fixture is given.
 @contextmanager
-def bufio_params_tracker(cache_size=units.meg(300), max_age=300):
-    def worker(p, stop_event):
-        while not stop_event.is_set():
-            log.info(
-                f"bufio cache size: {p.current_allocated // (1024 * 1024)}m/{p.max_cache_size // (1024 * 1024)}m"
-            )
-            time.sleep(0.5)
-
+def bufio_params_tracker(fix=None, cache_size=units.meg(300), max_age=300):
     p = BufioParams()
 
     # we must always set these, becuase prior tests may
@@ -252,21 +248,12 @@ def bufio_params_tracker(cache_size=units.meg(300), max_age=300):
     p.max_age = max_age
     p.peak_allocated = 0
 
-    stop_event = threading.Event()
-    tid = threading.Thread(
-        target=worker,
-        args=(
-            p,
-            stop_event,
-        ),
-    )
+    s = fix.sampler() if fix is not None else sampler.Sampler()
     try:
-        tid.start()
-        yield p
+        with s as smp:
+            smp.add_bufio()
+            yield p
     finally:
-        stop_event.set()
-        tid.join()
-
         # check max_cache_size was observed.  We can only do this roughly since
         # it takes time for the cleaner to kick in).
         if p.peak_allocated > int(p.max_cache_size * units.meg(512) * 512):
@@ -278,11 +265,11 @@ def bufio_params_tracker(cache_size=units.meg(300), max_age=300):
 # Activate bufio test device and create a thread set.  max_cache_size is given
 # in sectors
 @contextmanager
-def bufio_tester(data_dev, **opts):
+def bufio_tester(data_dev, fix=None, **opts):
     data_size = utils.dev_size(data_dev)
     t = table.Table(targets.BufioTestTarget(data_size, data_dev))
 
-    with bufio_params_tracker(**opts):
+    with bufio_params_tracker(fix, **opts):
         with dmdev.dev(t) as dev:
             with ThreadSet(dev) as thread_set:
                 yield thread_set
@@ -292,12 +279,12 @@ def bufio_tester(data_dev, **opts):
 
 
 def t_create(fix):
-    with bufio_tester(fix.cfg["data_dev"]):
+    with bufio_tester(fix.cfg["data_dev"], fix=fix):
         pass
 
 
 def t_empty_program(fix):
-    with bufio_tester(fix.cfg["data_dev"]) as tester:
+    with bufio_tester(fix.cfg["data_dev"], fix=fix) as tester:
         with tester.program():
             pass
 
@@ -318,14 +305,14 @@ def t_new_buf(fix):
     nr_threads = 16
     nr_gets = 1024
 
-    with bufio_tester(fix.cfg["data_dev"]) as tester:
+    with bufio_tester(fix.cfg["data_dev"], fix=fix) as tester:
         for t in range(nr_threads):
             with tester.program() as p:
                 do_new_buf(p, t * nr_gets)
 
 
 def t_stamper(fix):
-    with bufio_tester(fix.cfg["data_dev"]) as tester:
+    with bufio_tester(fix.cfg["data_dev"], fix=fix) as tester:
         with tester.program() as p:
             block = p.alloc_reg()
             buf = p.alloc_reg()
@@ -386,7 +373,7 @@ def t_many_stampers(fix):
     nr_threads = 16
     nr_gets = 1024
 
-    with bufio_tester(fix.cfg["data_dev"]) as tester:
+    with bufio_tester(fix.cfg["data_dev"], fix=fix) as tester:
         for t in range(nr_threads):
             with tester.program() as p:
                 do_stamper(p, t * nr_gets)
@@ -396,7 +383,7 @@ def t_writeback_nothing(fix):
     data_dev = fix.cfg["data_dev"]
     nr_blocks = units.meg(512) // units.kilo(4)
 
-    with bufio_tester(data_dev) as tester:
+    with bufio_tester(data_dev, fix=fix) as tester:
         with tester.program() as p:
             block = p.alloc_reg()
             buf = p.alloc_reg()
@@ -422,7 +409,7 @@ def do_writes_hit_disk(fix, write_method):
     pattern_base = random.randint(0, 10240)
 
     # write pattern across disk
-    with bufio_tester(data_dev) as tester:
+    with bufio_tester(data_dev, fix=fix) as tester:
         with tester.program() as p:
             block = p.alloc_reg()
             buf = p.alloc_reg()
@@ -446,7 +433,7 @@ def do_writes_hit_disk(fix, write_method):
 
     # we teardown the tester and recreate to be sure
     # the writes have hit the disk before we verify.
-    with bufio_tester(data_dev) as tester:
+    with bufio_tester(data_dev, fix=fix) as tester:
         with tester.program() as p:
             block = p.alloc_reg()
             buf = p.alloc_reg()
@@ -480,7 +467,7 @@ def t_writeback_many(fix):
     data_dev = fix.cfg["data_dev"]
     nr_blocks = units.gig(8) // units.kilo(4)
 
-    with bufio_tester(data_dev) as tester:
+    with bufio_tester(data_dev, fix=fix) as tester:
         with tester.program() as p:
             block = p.alloc_reg()
             buf = p.alloc_reg()
@@ -510,7 +497,7 @@ def t_hotspots(fix):
 
     big_region_size = units.gig(1) // units.kilo(4)
 
-    with bufio_tester(fix.cfg["data_dev"]) as tester:
+    with bufio_tester(fix.cfg["data_dev"], fix=fix) as tester:
         # hotspot programs
         for b, e in regions:
             with tester.program() as p:
@@ -545,7 +532,7 @@ def t_hotspots2(fix):
 
     big_region_size = units.gig(1) // units.kilo(4)
 
-    with bufio_tester(fix.cfg["data_dev"]) as tester:
+    with bufio_tester(fix.cfg["data_dev"], fix=fix) as tester:
         # hotspot programs
         for b, e in regions:
             with tester.program() as p:
@@ -572,7 +559,7 @@ def t_hotspots2(fix):
 
 def run_cache(fix, table, nr_blocks):
     with dmdev.dev(table) as data:
-        with bufio_tester(data.path) as tester:
+        with bufio_tester(data.path, fix=fix) as tester:
             with tester.program() as p:
                 block = p.alloc_reg()
                 buf = p.alloc_reg()
@@ -624,7 +611,7 @@ def t_evict_old(fix):
     # we want to keep the dev around once the program has
     # executed, so we have to build the stack by hand
     # rather than use bufio_tester().
-    with bufio_params_tracker(max_age=30) as params:
+    with bufio_params_tracker(fix, max_age=30) as params:
         with dmdev.dev(t) as dev:
             with ThreadSet(dev) as tester:
                 with tester.program() as p:
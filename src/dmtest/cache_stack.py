@@ -137,7 +137,7 @@ class ManagedCacheStack:
         try:
             cmeta_table = self._vm.table("cmeta")
             cdata_table = self._vm.table("cdata")
-            with dmdev.dev(cmeta_table) as cmeta, dmdev.dev(cdata_table) as cdata:
+            with dmdev.devs(cmeta_table, cdata_table) as (cmeta, cdata):
                 self._support_devs = (cmeta, cdata)
                 yield self._support_devs
         finally:
@@ -0,0 +1,109 @@
+import dmtest.db as db
+import threading
+import time
+
+from contextlib import contextmanager
+from typing import List, NamedTuple, Sequence
+
+
+# Time spent in one program across a test.
+class CommandSummary(NamedTuple):
+    exe: str
+    calls: int
+    wall: float
+    user: float
+    sys: float
+    max_rss_kb: int
+
+
+class CommandTrace:
+    """
+    Collects a CommandRecord for every external command, or ioctl, a test
+    runs.
+    """
+
+    def __init__(self):
+        self._records: List[db.CommandRecord] = []
+        self._lock = threading.Lock()
+
+    def add(self, record: db.CommandRecord):
+        # commands may be run from several threads at once
+        with self._lock:
+            self._records.append(record)
+
+    @property
+    def records(self) -> List[db.CommandRecord]:
+        with self._lock:
+            return list(self._records)
+
+
+def summarise(records: Sequence[db.CommandRecord]) -> List[CommandSummary]:
+    """
+    Totals the records for each program, most wall time first.
+    """
+    totals = {}
+    for r in records:
+        s = totals.get(r.exe)
+        if s is None:
+            totals[r.exe] = CommandSummary(
+                r.exe, 1, r.wall, r.user, r.sys, r.max_rss_kb
+            )
+        else:
+            totals[r.exe] = CommandSummary(
+                r.exe,
+                s.calls + 1,
+                s.wall + r.wall,
+                s.user + r.user,
+                s.sys + r.sys,
+                max(s.max_rss_kb, r.max_rss_kb),
+            )
+    return sorted(totals.values(), key=lambda s: s.wall, reverse=True)
+
+
+def format_summary(s: CommandSummary) -> str:
+    return (
+        f"{s.exe}: {s.calls} calls, {s.wall:.2f}s "
+        f"(user {s.user:.2f}s, sys {s.sys:.2f}s, max rss {s.max_rss_kb // 1024}M)"
+    )
+
+
+global_command_trace = None
+
+
+@contextmanager
+def command_trace():
+    global global_command_trace
+
+    assert not global_command_trace
+    global_command_trace = CommandTrace()
+    try:
+        yield global_command_trace
+    finally:
+        global_command_trace = None
+
+
+def add_record(record: db.CommandRecord):
+    if global_command_trace:
+        global_command_trace.add(record)
+
+
+@contextmanager
+def timed(exe: str, command: str):
+    """
+    Records the wall time of an operation done in process, eg. an ioctl,
+    so it's accounted for alongside the commands run.  An OSError is
+    recorded as the exit code.
+    """
+    start = time.monotonic()
+    exit_code = 0
+    try:
+        yield
+    except OSError as e:
+        exit_code = e.errno or 1
+        raise
+    finally:
+        add_record(
+            db.CommandRecord(
+                exe, command, time.monotonic() - start, 0.0, 0.0, 0, exit_code
+            )
+        )
@@ -1,6 +1,35 @@
+import json
 import sqlite3
 import zlib
-from typing import NamedTuple, Optional, List
+from array import array
+from typing import Dict, NamedTuple, Optional, List, Sequence, Set
+
+
+# A numeric result, such as throughput or latency, recorded by a test.
+class Metric(NamedTuple):
+    name: str
+    value: float
+    unit: str
+
+
+# Values sampled over the course of a test, eg. pool data usage, with
+# the times they were taken at in seconds.
+class Series(NamedTuple):
+    name: str
+    unit: str
+    times: Sequence[float]
+    values: Sequence[float]
+
+
+# An external command, or ioctl, run by a test.  Times are in seconds.
+class CommandRecord(NamedTuple):
+    exe: str
+    command: str
+    wall: float
+    user: float
+    sys: float
+    max_rss_kb: int
+    exit_code: int
 
 
 class TestResult(NamedTuple):
@@ -11,6 +40,38 @@ class TestResult(NamedTuple):
     result_set: str
     duration: float
     run_nr: int
+    metrics: Sequence[Metric] = ()
+    series: Sequence[Series] = ()
+    commands: Sequence[CommandRecord] = ()
+
+
+# A test result without the log and dmesg, for when only the outcome
+# is needed.
+class TestSummary(NamedTuple):
+    test_name: str
+    pass_fail: str
+    duration: float
+    run_nr: int
+
+
+class MetricResult(NamedTuple):
+    test_name: str
+    run_nr: int
+    name: str
+    value: float
+    unit: str
+
+
+class CommandsResult(NamedTuple):
+    test_name: str
+    run_nr: int
+    commands: Sequence[CommandRecord]
+
+
+class SeriesResult(NamedTuple):
+    test_name: str
+    run_nr: int
+    series: Series
 
 
 class NoSuchResultSet(Exception):
@@ -21,11 +82,174 @@ class ResultSetInUse(Exception):
     pass
 
 
+class SchemaVersionError(Exception):
+    pass
+
+
+# -----------------------------------------
+# Schema migrations
+#
+# Each migration upgrades the schema by one version, and is passed a
+# cursor within the transaction that applies it.  Databases that predate
+# versioning are at version 0, with or without the original tables, so
+# the first migration must be idempotent.  Never edit a migration once it
+# has been released; append a new one.
+
+
+def _create_tables(cursor):
+    # Create the 'result_sets' table
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS result_sets (
+        result_set_id INTEGER PRIMARY KEY,
+        result_set TEXT UNIQUE
+    )
+    """
+    )
+
+    # Create the 'test_names' table
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS test_names (
+        test_name_id INTEGER PRIMARY KEY,
+        test_name TEXT UNIQUE
+    )
+    """
+    )
+
+    # Create the 'test_results' table
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS test_results (
+        test_id INTEGER PRIMARY KEY,
+        test_name_id INTEGER,
+        pass_fail TEXT,
+        log BLOB,
+        dmesg BLOB,
+        result_set_id INTEGER,
+        duration REAL,
+        run_nr INTEGER,
+        FOREIGN KEY (result_set_id) REFERENCES result_sets (result_set_id)
+        FOREIGN KEY (test_name_id) REFERENCES test_names (test_name_id),
+        UNIQUE (test_name_id, result_set_id, run_nr)
+    )
+    """
+    )
+
+
+def _index_result_sets(cursor):
+    # The unique constraint on test_results indexes on test_name_id first,
+    # which doesn't help when scanning, or deleting, a whole result set.
+    cursor.execute(
+        """
+    CREATE INDEX IF NOT EXISTS test_results_by_result_set
+        ON test_results (result_set_id)
+    """
+    )
+
+
+def _create_metrics(cursor):
+    cursor.execute(
+        """
+    CREATE TABLE metrics (
+        metric_id INTEGER PRIMARY KEY,
+        test_name_id INTEGER,
+        result_set_id INTEGER,
+        run_nr INTEGER,
+        metric_name TEXT,
+        value REAL,
+        unit TEXT,
+        FOREIGN KEY (result_set_id) REFERENCES result_sets (result_set_id)
+        FOREIGN KEY (test_name_id) REFERENCES test_names (test_name_id),
+        UNIQUE (test_name_id, result_set_id, run_nr, metric_name)
+    )
+    """
+    )
+
+    cursor.execute(
+        """
+    CREATE INDEX metrics_by_result_set ON metrics (result_set_id)
+    """
+    )
+
+
+def _create_series(cursor):
+    # 'samples' holds the times then the values, as compressed arrays of
+    # native doubles.
+    cursor.execute(
+        """
+    CREATE TABLE series (
+        series_id INTEGER PRIMARY KEY,
+        test_name_id INTEGER,
+        result_set_id INTEGER,
+        run_nr INTEGER,
+        series_name TEXT,
+        unit TEXT,
+        nr_samples INTEGER,
+        samples BLOB,
+        FOREIGN KEY (result_set_id) REFERENCES result_sets (result_set_id)
+        FOREIGN KEY (test_name_id) REFERENCES test_names (test_name_id),
+        UNIQUE (test_name_id, result_set_id, run_nr, series_name)
+    )
+    """
+    )
+
+    cursor.execute(
+        """
+    CREATE INDEX series_by_result_set ON series (result_set_id)
+    """
+    )
+
+
+def _add_commands(cursor):
+    # compressed json list of CommandRecords
+    cursor.execute("ALTER TABLE test_results ADD COLUMN commands BLOB")
+
+
+migrations = [
+    _create_tables,
+    _index_result_sets,
+    _create_metrics,
+    _create_series,
+    _add_commands,
+]
+
+
+def _encode_samples(s: Series) -> bytes:
+    return zlib.compress(array("d", s.times).tobytes() + array("d", s.values).tobytes())
+
+
+def _encode_commands(commands: Sequence[CommandRecord]) -> bytes:
+    return zlib.compress(json.dumps([list(c) for c in commands]).encode("utf-8"))
+
+
+def _decode_commands(blob) -> List[CommandRecord]:
+    if blob is None:
+        return []
+    return [CommandRecord(*c) for c in json.loads(zlib.decompress(blob))]
+
+
+def _decode_samples(name, unit, nr_samples, blob) -> Series:
+    samples = array("d")
+    samples.frombytes(zlib.decompress(blob))
+    return Series(name, unit, samples[:nr_samples], samples[nr_samples:])
+
+
 class TestResults:
     def __init__(self, path):
         # Connect to the SQLite database (create the file if it doesn't exist)
         self._conn = sqlite3.connect(path)
-        self._create_tables()
+
+        # WAL lets readers, eg. 'dmtest list', carry on while a run is
+        # inserting results.  NORMAL sync is safe in WAL mode.
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+
+        # Ids never change once allocated, so we cache them
+        self._result_set_ids: Dict[str, int] = {}
+        self._test_name_ids: Dict[str, int] = {}
+
+        self._migrate()
 
     def __enter__(self):
         return self
@@ -33,59 +257,67 @@ class TestResults:
     def __exit__(self, _exc_type, _exc_value, _traceback):
         self._conn.close()
 
-    def _create_tables(self):
-        cursor = self._conn.cursor()
-
-        # Create the 'result_sets' table
+    def _schema_version(self, cursor) -> int:
         cursor.execute(
-            """
-        CREATE TABLE IF NOT EXISTS result_sets (
-            result_set_id INTEGER PRIMARY KEY,
-            result_set TEXT UNIQUE
-        )
-        """
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'"
         )
+        if cursor.fetchone() is None:
+            return 0
 
-        # Create the 'test_names' table
-        cursor.execute(
-            """
-        CREATE TABLE IF NOT EXISTS test_names (
-            test_name_id INTEGER PRIMARY KEY,
-            test_name TEXT UNIQUE
-        )
-        """
-        )
+        cursor.execute("SELECT version FROM schema_version")
+        row = cursor.fetchone()
+        return 0 if row is None else row[0]
 
-        # Create the 'test_results' table
-        cursor.execute(
-            """
-        CREATE TABLE IF NOT EXISTS test_results (
-            test_id INTEGER PRIMARY KEY,
-            test_name_id INTEGER,
-            pass_fail TEXT,
-            log BLOB,
-            dmesg BLOB,
-            result_set_id INTEGER,
-            duration REAL,
-            run_nr INTEGER,
-            FOREIGN KEY (result_set_id) REFERENCES result_sets (result_set_id)
-            FOREIGN KEY (test_name_id) REFERENCES test_names (test_name_id),
-            UNIQUE (test_name_id, result_set_id, run_nr)
-        )
-        """
-        )
+    def _migrate(self):
+        cursor = self._conn.cursor()
+        if self._schema_version(cursor) == len(migrations):
+            return
+
+        # Take the write lock before re-reading the version, in case another
+        # dmtest process is upgrading the database at the same time.  DDL
+        # isn't covered by sqlite3's implicit transactions, so we begin one
+        # explicitly; all migrations are applied, or none are.
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            version = self._schema_version(cursor)
+            if version > len(migrations):
+                raise SchemaVersionError(
+                    f"database schema version {version} is newer than this dmtest supports ({len(migrations)})"
+                )
+
+            for migration in migrations[version:]:
+                migration(cursor)
 
-        # Commit the changes
-        self._conn.commit()
+            cursor.execute(
+                "CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"
+            )
+            cursor.execute("DELETE FROM schema_version")
+            cursor.execute(
+                "INSERT INTO schema_version (version) VALUES (?)", (len(migrations),)
+            )
+            self._conn.commit()
+        except Exception:
+            self._conn.rollback()
+            raise
+
+    # Inserts, without committing, and returns the id.
+    def _insert_result_set(self, cursor, result_set):
+        result_set_id = self.get_result_set_id(result_set)
+        if result_set_id is None:
+            cursor.execute(
+                "INSERT OR IGNORE INTO result_sets (result_set) VALUES (?)", (result_set,)
+            )
+            result_set_id = self.get_result_set_id(result_set)
+        return result_set_id
 
     def insert_result_set(self, result_set):
-        cursor = self._conn.cursor()
-        cursor.execute(
-            "INSERT OR IGNORE INTO result_sets (result_set) VALUES (?)", (result_set,)
-        )
-        self._conn.commit()
+        with self._conn:
+            self._insert_result_set(self._conn.cursor(), result_set)
 
     def get_result_set_id(self, result_set):
+        if result_set in self._result_set_ids:
+            return self._result_set_ids[result_set]
+
         cursor = self._conn.cursor()
         cursor.execute(
             "SELECT result_set_id FROM result_sets WHERE result_set = ?", (result_set,)
@@ -95,18 +327,29 @@ class TestResults:
         if row is None:
             return None
 
+        self._result_set_ids[result_set] = row[0]
         return row[0]
 
+    # Inserts, without committing, and returns the id.
+    def _insert_test_name(self, cursor, test_name):
+        test_name_id = self.get_test_name_id(test_name)
+        if test_name_id is None:
+            cursor.execute(
+                "INSERT OR IGNORE INTO test_names (test_name) VALUES (?)", (test_name,)
+            )
+            test_name_id = self.get_test_name_id(test_name)
+        return test_name_id
+
     # Function to insert a test name
     def insert_test_name(self, test_name):
-        cursor = self._conn.cursor()
-        cursor.execute(
-            "INSERT OR IGNORE INTO test_names (test_name) VALUES (?)", (test_name,)
-        )
-        self._conn.commit()
+        with self._conn:
+            self._insert_test_name(self._conn.cursor(), test_name)
 
     # Function to get the test_name_id for a given test name
     def get_test_name_id(self, test_name):
+        if test_name in self._test_name_ids:
+            return self._test_name_ids[test_name]
+
         cursor = self._conn.cursor()
         cursor.execute(
             "SELECT test_name_id FROM test_names WHERE test_name = ?", (test_name,)
@@ -116,27 +359,66 @@ class TestResults:
         if row is None:
             return None
 
+        self._test_name_ids[test_name] = row[0]
         return row[0]
 
+    def _forget_ids(self):
+        self._result_set_ids.clear()
+        self._test_name_ids.clear()
+
     # Function to insert a test result
     def insert_test_result(self, result: TestResult, with_delete: bool):
-        self.insert_test_name(result.test_name)
-        test_name_id = self.get_test_name_id(result.test_name)
-
-        self.insert_result_set(result.result_set)
-        result_set_id = self.get_result_set_id(result.result_set)
-
+        # Compress outside the transaction, so the database is locked for as
+        # short a time as possible.
+        compressed_log = zlib.compress(result.log.encode("utf-8"))
+        compressed_dmesg = zlib.compress(result.dmesg.encode("utf-8"))
+        encoded_series = [(s, _encode_samples(s)) for s in result.series]
+        compressed_commands = _encode_commands(result.commands)
+
+        try:
+            with self._conn:
+                self._insert_test_result(
+                    result,
+                    with_delete,
+                    compressed_log,
+                    compressed_dmesg,
+                    encoded_series,
+                    compressed_commands,
+                )
+        except Exception:
+            # any ids allocated in the transaction have been rolled back
+            self._forget_ids()
+            raise
+
+    def _insert_test_result(
+        self,
+        result,
+        with_delete,
+        compressed_log,
+        compressed_dmesg,
+        encoded_series,
+        compressed_commands,
+    ):
         cursor = self._conn.cursor()
+        test_name_id = self._insert_test_name(cursor, result.test_name)
+        result_set_id = self._insert_result_set(cursor, result.result_set)
+
         if with_delete:
             cursor.execute(
                 "DELETE FROM test_results WHERE test_name_id = ? AND result_set_id = ?",
                 (test_name_id, result_set_id),
             )
+            cursor.execute(
+                "DELETE FROM metrics WHERE test_name_id = ? AND result_set_id = ?",
+                (test_name_id, result_set_id),
+            )
+            cursor.execute(
+                "DELETE FROM series WHERE test_name_id = ? AND result_set_id = ?",
+                (test_name_id, result_set_id),
+            )
 
-        compressed_log = zlib.compress(result.log.encode("utf-8"))
-        compressed_dmesg = zlib.compress(result.dmesg.encode("utf-8"))
         cursor.execute(
-            "INSERT INTO test_results (test_name_id, pass_fail, log, dmesg, result_set_id, duration, run_nr) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            "INSERT INTO test_results (test_name_id, pass_fail, log, dmesg, result_set_id, duration, run_nr, commands) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
             (
                 test_name_id,
                 result.pass_fail,
@@ -145,9 +427,25 @@ class TestResults:
                 result_set_id,
                 result.duration,
                 result.run_nr,
+                compressed_commands,
             ),
         )
-        self._conn.commit()
+
+        cursor.executemany(
+            "INSERT INTO metrics (test_name_id, result_set_id, run_nr, metric_name, value, unit) VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (test_name_id, result_set_id, result.run_nr, m.name, m.value, m.unit)
+                for m in result.metrics
+            ],
+        )
+
+        cursor.executemany(
+            "INSERT INTO series (test_name_id, result_set_id, run_nr, series_name, unit, nr_samples, samples) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (test_name_id, result_set_id, result.run_nr, s.name, s.unit, len(s.times), blob)
+                for s, blob in encoded_series
+            ],
+        )
 
     def get_test_results(
         self, test_name: str, result_set: str, run_nr: Optional[int] = None
@@ -155,7 +453,7 @@ class TestResults:
         test_name_id = self.get_test_name_id(test_name)
         result_set_id = self.get_result_set_id(result_set)
         sql_cmd = """
-            SELECT test_names.test_name, test_results.pass_fail, test_results.log, test_results.dmesg, result_sets.result_set, test_results.duration, test_results.run_nr
+            SELECT test_names.test_name, test_results.pass_fail, test_results.log, test_results.dmesg, result_sets.result_set, test_results.duration, test_results.run_nr, test_results.commands
             FROM test_results
             JOIN test_names ON test_results.test_name_id = test_names.test_name_id
             JOIN result_sets ON test_results.result_set_id = result_sets.result_set_id
@@ -190,36 +488,163 @@ class TestResults:
                 result_set=row[4],
                 duration=row[5],
                 run_nr=row[6],
+                commands=_decode_commands(row[7]),
             )
             test_results.append(test_result)
 
         return test_results
 
+    # Returns summaries of every result in a result set, keyed on test name,
+    # using a single query.
+    def get_result_set_summaries(self, result_set: str) -> Dict[str, List[TestSummary]]:
+        cursor = self._conn.cursor()
+        cursor.execute(
+            """
+            SELECT test_names.test_name, test_results.pass_fail, test_results.duration, test_results.run_nr
+            FROM test_results
+            JOIN test_names ON test_results.test_name_id = test_names.test_name_id
+            JOIN result_sets ON test_results.result_set_id = result_sets.result_set_id
+            WHERE result_sets.result_set = ?
+            ORDER BY test_results.run_nr
+            """,
+            (result_set,),
+        )
+
+        summaries: Dict[str, List[TestSummary]] = {}
+        for row in cursor.fetchall():
+            summaries.setdefault(row[0], []).append(TestSummary(*row))
+        return summaries
+
+    # Returns every metric recorded in a result set, keyed on test name.
+    def get_result_set_metrics(self, result_set: str) -> Dict[str, List[MetricResult]]:
+        cursor = self._conn.cursor()
+        cursor.execute(
+            """
+            SELECT test_names.test_name, metrics.run_nr, metrics.metric_name, metrics.value, metrics.unit
+            FROM metrics
+            JOIN test_names ON metrics.test_name_id = test_names.test_name_id
+            JOIN result_sets ON metrics.result_set_id = result_sets.result_set_id
+            WHERE result_sets.result_set = ?
+            ORDER BY metrics.run_nr, metrics.metric_id
+            """,
+            (result_set,),
+        )
+
+        metrics: Dict[str, List[MetricResult]] = {}
+        for row in cursor.fetchall():
+            metrics.setdefault(row[0], []).append(MetricResult(*row))
+        return metrics
+
+    # Returns the commands run by each test in a result set, keyed on test
+    # name.
+    def get_result_set_commands(self, result_set: str) -> Dict[str, List[CommandsResult]]:
+        cursor = self._conn.cursor()
+        cursor.execute(
+            """
+            SELECT test_names.test_name, test_results.run_nr, test_results.commands
+            FROM test_results
+            JOIN test_names ON test_results.test_name_id = test_names.test_name_id
+            JOIN result_sets ON test_results.result_set_id = result_sets.result_set_id
+            WHERE result_sets.result_set = ?
+            ORDER BY test_results.run_nr
+            """,
+            (result_set,),
+        )
+
+        commands: Dict[str, List[CommandsResult]] = {}
+        for row in cursor.fetchall():
+            r = CommandsResult(row[0], row[1], _decode_commands(row[2]))
+            commands.setdefault(row[0], []).append(r)
+        return commands
+
+    # Returns every series recorded in a result set, keyed on test name.
+    def get_result_set_series(self, result_set: str) -> Dict[str, List[SeriesResult]]:
+        cursor = self._conn.cursor()
+        cursor.execute(
+            """
+            SELECT test_names.test_name, series.run_nr, series.series_name, series.unit, series.nr_samples, series.samples
+            FROM series
+            JOIN test_names ON series.test_name_id = test_names.test_name_id
+            JOIN result_sets ON series.result_set_id = result_sets.result_set_id
+            WHERE result_sets.result_set = ?
+            ORDER BY series.run_nr, series.series_id
+            """,
+            (result_set,),
+        )
+
+        series: Dict[str, List[SeriesResult]] = {}
+        for row in cursor.fetchall():
+            s = _decode_samples(*row[2:])
+            series.setdefault(row[0], []).append(SeriesResult(row[0], row[1], s))
+        return series
+
     def get_result_sets(self) -> List[str]:
         cursor = self._conn.cursor()
         cursor.execute("SELECT result_set FROM result_sets")
         rows = cursor.fetchall()
         return [row[0] for row in rows]
 
+    # Returns every recorded duration for each test, across all result sets,
+    # for runs that finished in the given state.
+    def get_durations(self, pass_fail: str = "PASS") -> Dict[str, List[float]]:
+        cursor = self._conn.cursor()
+        cursor.execute(
+            """
+            SELECT test_names.test_name, test_results.duration
+            FROM test_results
+            JOIN test_names ON test_results.test_name_id = test_names.test_name_id
+            WHERE test_results.pass_fail = ?
+            """,
+            (pass_fail,),
+        )
+
+        durations: Dict[str, List[float]] = {}
+        for name, duration in cursor.fetchall():
+            durations.setdefault(name, []).append(duration)
+        return durations
+
+    # Returns the names of tests with a failed, timed out or tainted run in
+    # the given result set.
+    def get_failed_tests(self, result_set: str) -> Set[str]:
+        cursor = self._conn.cursor()
+        cursor.execute(
+            """
+            SELECT DISTINCT test_names.test_name
+            FROM test_results
+            JOIN test_names ON test_results.test_name_id = test_names.test_name_id
+            JOIN result_sets ON test_results.result_set_id = result_sets.result_set_id
+            WHERE result_sets.result_set = ?
+            AND test_results.pass_fail IN ('FAIL', 'TIMEOUT', 'TAINTED')
+            """,
+            (result_set,),
+        )
+        return {row[0] for row in cursor.fetchall()}
+
     # Removes a result_set and all test results associated with it.
     def delete_result_set(self, result_set):
         cursor = self._conn.cursor()
         result_set_id = self.get_result_set_id(result_set)
 
         if result_set_id is None:
-            raise NoSuchResultSet("Result set '{result_set}' not found")
+            raise NoSuchResultSet(f"Result set '{result_set}' not found")
 
-        # Remove test results associated with the result_set_id
-        cursor.execute(
-            "DELETE FROM test_results WHERE result_set_id = ?", (result_set_id,)
-        )
-        self._conn.commit()
+        with self._conn:
+            # Remove test results associated with the result_set_id
+            cursor.execute(
+                "DELETE FROM test_results WHERE result_set_id = ?", (result_set_id,)
+            )
+            cursor.execute(
+                "DELETE FROM metrics WHERE result_set_id = ?", (result_set_id,)
+            )
+            cursor.execute(
+                "DELETE FROM series WHERE result_set_id = ?", (result_set_id,)
+            )
 
-        # Remove the result set
-        cursor.execute(
-            "DELETE FROM result_sets WHERE result_set_id = ?", (result_set_id,)
-        )
-        self._conn.commit()
+            # Remove the result set
+            cursor.execute(
+                "DELETE FROM result_sets WHERE result_set_id = ?", (result_set_id,)
+            )
+        self._result_set_ids.pop(result_set, None)
 
     def rename_result_set(self, old_result_set, new_result_set):
         cursor = self._conn.cursor()
@@ -236,3 +661,4 @@ class TestResults:
             (new_result_set, result_set_id),
         )
         self._conn.commit()
+        self._result_set_ids.pop(old_result_set, None)
@@ -1,7 +1,12 @@
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
+from typing import List, Optional
 import random
+import time
 
 import dmtest.device_mapper.interface as dm
+import dmtest.device_mapper.status as dm_status
+import dmtest.geometry as geometry
 
 
 class Dev:
@@ -9,8 +14,19 @@ class Dev:
         self._name = name
         self._path = f"/dev/mapper/{name}"
         self._active_table = None
+
+        # Status is re-fetched if the cached copy is older than this many
+        # seconds.  Off by default, since io changes status without us
+        # knowing.  Anything done through this object clears the cache.
+        self.status_ttl = 0.0
+        self._status_cache = None
+
         dm.create(self._name)
 
+        # the device number may have belonged to a device removed behind
+        # our back
+        geometry.invalidate(self)
+
     def __str__(self):
         return self._path
 
@@ -27,36 +43,76 @@ class Dev:
         return self._path
 
     def load(self, table):
+        self._status_cache = None
         self._active_table = table
         dm.load(self._name, table)
+        geometry.invalidate(self)
 
     def load_ro(self, table):
+        self._status_cache = None
         self._active_table = table
         dm.load_ro(self._name, table)
+        geometry.invalidate(self)
 
     def suspend(self):
+        self._status_cache = None
         dm.suspend(self._name)
 
     def suspend_noflush(self):
+        self._status_cache = None
         dm.suspend_noflush(self._name)
 
     def resume(self):
+        self._status_cache = None
         dm.resume(self._name)
+        geometry.invalidate(self)
 
     def remove(self):
+        self._status_cache = None
+        geometry.invalidate(self)
         dm.remove(self._name)
         if self._active_table is not None:
             for target in self._active_table:
                 target.post_remove_check()
 
     def message(self, sector, *args):
+        self._status_cache = None
         return dm.message(self._name, sector, *args)
 
-    def status(self, noflush=False):
+    def messages(self, sector, msgs, stop_on_error=False):
+        self._status_cache = None
+        return dm.messages(self._name, sector, msgs, stop_on_error=stop_on_error)
+
+    def _fetch_status(self, noflush):
+        c = self._status_cache
+        if (
+            c is not None
+            and c[1] == noflush
+            and time.monotonic() - c[0] < self.status_ttl
+        ):
+            return c
+
         if noflush:
-            return dm.status(self._name, "--noflush")
+            txt = dm.status(self._name, "--noflush")
         else:
-            return dm.status(self._name)
+            txt = dm.status(self._name)
+
+        # [time, noflush, text, parsed], parsed lazily
+        self._status_cache = [time.monotonic(), noflush, txt, None]
+        return self._status_cache
+
+    def status(self, noflush=False):
+        return self._fetch_status(noflush)[2]
+
+    def parsed_status(self, noflush=False):
+        """
+        The status of each target, parsed into objects from
+        device_mapper.status.  Parsed once per fetch.
+        """
+        c = self._fetch_status(noflush)
+        if c[3] is None:
+            c[3] = dm_status.parse_status(c[2])
+        return c[3]
 
     def table(self):
         return dm.table(self._name)
@@ -64,12 +120,30 @@ class Dev:
     def info(self):
         return dm.info(self._name)
 
-    def wait(self, event_nr):
-        dm.wait(self._name, event_nr)
+    def wait(self, event_nr, timeout=None):
+        """
+        Blocks until the device's event number moves on from 'event_nr',
+        and returns the new one.
+        """
+        if timeout is None:
+            return dm.wait(self._name, event_nr)
+
+        def moved_on():
+            n = self.event_nr()
+            return n if n != event_nr else None
+
+        return dm.wait_for(moved_on, timeout)
 
     def event_nr(self):
-        output = dm.status(self._name, "-v")
-        dm.parse_event_nr(output)
+        return dm.event_nr(self._name)
+
+    def wait_for(self, predicate, timeout=None, interval=1.0):
+        """
+        Waits for predicate(), typically checking this device's status,
+        to return a true value, rechecking whenever a device-mapper event
+        is raised, and every 'interval' seconds.
+        """
+        return dm.wait_for(predicate, timeout, interval)
 
     def __enter__(self):
         return self
@@ -89,10 +163,23 @@ class Dev:
             dev.resume()
 
 
+# The most devices devs() creates, loads or removes at once.
+MAX_WORKERS = 8
+
+
 def random_name():
     return f"test-dev-{random.randint(0, 1000000)}"
 
 
+def _random_names(count):
+    names = []
+    while len(names) < count:
+        name = random_name()
+        if name not in names:
+            names.append(name)
+    return names
+
+
 def dev(table, read_only=False):
     """
     A context manager for creating, using, and automatically cleaning up a device-mapper device.
@@ -133,42 +220,140 @@ class DeviceCleanupError(Exception):
         self.errors = errors
 
 
+def _run_all(fn, items):
+    """
+    Calls fn on each item concurrently, and waits for them all to finish.
+    Returns a list of results, with None for those that raised, and a list
+    of the exceptions raised.
+    """
+    if len(items) <= 1:
+        futures = None
+    else:
+        pool = ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(items)))
+        try:
+            futures = [pool.submit(fn, item) for item in items]
+        finally:
+            try:
+                pool.shutdown(wait=True)
+            except BaseException:
+                # KernelOops or TestTimeout arrived while we waited.  They're
+                # only raised once, so wait again rather than leaving the
+                # workers running behind the caller's cleanup.
+                pool.shutdown(wait=True)
+                raise
+
+    results = []
+    errors = []
+    for i, item in enumerate(items):
+        try:
+            if futures is None:
+                results.append(fn(item))
+            else:
+                results.append(futures[i].result())
+        except Exception as e:
+            results.append(None)
+            errors.append(e)
+    return (results, errors)
+
+
+def _dependencies(table, paths):
+    """
+    The indexes, into 'paths', of the devices a table sits on.
+    """
+    deps = set()
+    for target in table:
+        for arg in target.args:
+            i = paths.get(str(arg))
+            if i is not None:
+                deps.add(i)
+    return deps
+
+
+def _activation_order(tables, dev_instances):
+    """
+    Groups the devices into waves, each only depending on devices in
+    earlier waves.
+    """
+    paths = {d.path: i for i, d in enumerate(dev_instances)}
+    deps = [_dependencies(t, paths) for t in tables]
+
+    waves = []
+    done = set()
+    while len(done) < len(tables):
+        wave = [i for i in range(len(tables)) if i not in done and deps[i] <= done]
+        if not wave:
+            raise ValueError("device tables have circular dependencies")
+        waves.append(wave)
+        done.update(wave)
+    return waves
+
+
+def _activate(dev_instance, table):
+    dev_instance.load(table)
+    dev_instance.resume()
+
+
 @contextmanager
 def devs(*tables):
     """
     Creates one or more anonymous device-mapper devices and yields a tuple of
     the created devices.
+
+    The devices are created concurrently.  A table may also be a function,
+    called with the tuple of devices once they've been created, so devices
+    can be stacked on one another.  Each device is loaded and resumed once
+    the devices its table refers to are; independent devices are activated,
+    and removed, concurrently.
     Args:
-        tables (list): A tuple of table strings, one for each device to
-                        create.
+        tables (list): A tuple of tables, or functions returning tables, one
+                       for each device to create.
     Yields:
         list: A tuple of the created device-mapper devices.
     Raises:
         Exception: If any device-mapper devices fail to create.
         DeviceCleanupError: If any device-mapper devices fail to remove.
     """
-    dev_instances = []
+    # Each device is recorded as soon as it's created, so it's removed
+    # even if we're interrupted before they've all been.
+    created: List[Optional[Dev]] = [None] * len(tables)
+    names = _random_names(len(tables))
+
+    # until the tables are loaded, nothing depends on anything else
+    waves = [list(range(len(tables)))]
+
+    def create(i):
+        created[i] = Dev(names[i])
 
     try:
         # Create devices
-        for table in tables:
-            name = random_name()
-            dev_instance = Dev(name)
-            dev_instance.load(table)
-            dev_instance.resume()
-            dev_instances.append(dev_instance)
+        _, errors = _run_all(create, range(len(tables)))
+        if errors:
+            raise errors[0]
+        dev_instances = tuple(d for d in created if d is not None)
 
-        yield tuple(dev_instances)
+        tables = [t(dev_instances) if callable(t) else t for t in tables]
+        waves = _activation_order(tables, dev_instances)
+
+        # Activate them, dependencies first
+        for wave in waves:
+
+            def activate(i):
+                _activate(dev_instances[i], tables[i])
+
+            _, errors = _run_all(activate, wave)
+            if errors:
+                raise errors[0]
+
+        yield dev_instances
 
     finally:
-        # Remove devices and handle exceptions
+        # Remove devices, dependents first, and handle exceptions
         cleanup_errors = []
 
-        for dev_instance in dev_instances:
-            try:
-                dev_instance.remove()
-            except Exception as e:
-                cleanup_errors.append(e)
+        for wave in reversed(waves):
+            live = [created[i] for i in wave if created[i] is not None]
+            _, errors = _run_all(lambda d: d.remove(), live)
+            cleanup_errors.extend(errors)
 
         if cleanup_errors:
             raise DeviceCleanupError(cleanup_errors)
@@ -0,0 +1,99 @@
+import logging as log
+import subprocess
+import time
+
+from dmtest.process import run
+
+# Device-mapper backend that runs dmsetup for every operation.
+
+
+def create(name):
+    run(f"dmsetup create {name} --notable")
+
+
+def load(name, table, read_only=False):
+    ro = "--readonly " if read_only else ""
+    lines = table.table_lines()
+    log.info(f"table for {name}:\n{lines}")
+    # dmsetup reads the table from stdin if no file is given
+    run(f"dmsetup load {ro}{name}", input=lines + "\n")
+
+
+def suspend(name, noflush=False):
+    if noflush:
+        run(f"dmsetup suspend --noflush {name}")
+    else:
+        run(f"dmsetup suspend {name}")
+
+
+def resume(name):
+    run(f"dmsetup resume {name}")
+
+
+def remove(name):
+    # --retry copes with udev briefly holding the device open
+    run(f"dmsetup remove --retry {name}")
+
+
+def message(name, sector, msg):
+    (_, stdout, _) = run(f"dmsetup message {name} {sector} {msg}")
+    return stdout
+
+
+def messages(name, sector, msgs, stop_on_error=False):
+    # dmsetup has no way to batch messages, so this just saves the caller
+    # a loop.
+    results = []
+    for msg in msgs:
+        try:
+            results.append((message(name, sector, msg), None))
+        except subprocess.CalledProcessError as e:
+            results.append((None, e))
+            if stop_on_error:
+                break
+    return results
+
+
+def status(name, noflush=False, verbose=False):
+    args = []
+    if noflush:
+        args.append("--noflush")
+    if verbose:
+        args.append("-v")
+    (_, stdout, _) = run(f"dmsetup status {' '.join(args)} {name}")
+    return stdout
+
+
+def table(name):
+    (_, stdout, _) = run(f"dmsetup table {name}")
+    return stdout
+
+
+def info(name):
+    (_, stdout, _) = run(f"dmsetup info {name}")
+    return stdout
+
+
+def wait(name, event_nr):
+    (_, stdout, _) = run(f"dmsetup wait -v {name} {event_nr}")
+    return stdout
+
+
+class _Sleeper:
+    # dmsetup can't wait for any event, so just sleep
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _exc_type, _exc_value, _traceback):
+        pass
+
+    def arm(self):
+        pass
+
+    def wait(self, timeout):
+        time.sleep(timeout)
+
+
+def event_poller():
+    return _Sleeper()
@@ -1,9 +1,39 @@
 import dmtest.dependency_tracker as dep
-import dmtest.utils as utils
+import dmtest.device_mapper.dmsetup as dmsetup
+import dmtest.device_mapper.ioctl as dm_ioctl
 import logging as log
+import os
 import re
-
-from dmtest.process import run
+import time
+
+# The device-mapper operations are implemented either by issuing ioctls
+# directly, which avoids spawning a process for every operation, or by
+# running dmsetup.  Both wait for udev to finish with a device after
+# creating, resuming or removing it.  dmsetup is the default; set
+# DMTEST_DM_BACKEND=ioctl to try the ioctl backend, which falls back to
+# dmsetup if /dev/mapper/control isn't usable.
+BACKENDS = {
+    "ioctl": dm_ioctl,
+    "dmsetup": dmsetup,
+}
+
+_backend = None
+
+
+def backend():
+    global _backend
+    if _backend is None:
+        name = os.environ.get("DMTEST_DM_BACKEND", "dmsetup")
+        if name not in BACKENDS:
+            raise ValueError(
+                f"unknown DMTEST_DM_BACKEND '{name}', expected one of: {', '.join(BACKENDS)}"
+            )
+        if name == "ioctl" and not dm_ioctl.available():
+            log.warning(f"{dm_ioctl.CONTROL} isn't usable, falling back to dmsetup")
+            name = "dmsetup"
+        log.info(f"using the {name} device-mapper backend")
+        _backend = BACKENDS[name]
+    return _backend
 
 
 def register_targets(table):
@@ -12,77 +42,130 @@ def register_targets(table):
 
 
 def create(name):
-    run(f"dmsetup create {name} --notable")
+    backend().create(name)
 
 
 def load(name, table):
     register_targets(table)
-    with utils.TempFile() as tf:
-        f = tf.file
-        lines = table.table_lines()
-        log.info(f"table file '{tf.path}':\n{lines}")
-        f.write(lines)
-        f.flush()
-        run(f"dmsetup load {name} {tf.path}")
+    backend().load(name, table)
 
 
 def load_ro(name, table):
     register_targets(table)
-    with utils.TempFile() as tf:
-        f = tf.file
-        lines = table.table_lines()
-        log.info(f"table file '{tf.path}':\n{lines}")
-        f.write(lines)
-        f.flush()
-        run(f"dmsetup load --readonly {name} {tf.path}")
+    backend().load(name, table, read_only=True)
 
 
 def suspend(name):
-    run(f"dmsetup suspend {name}")
+    backend().suspend(name)
 
 
 def suspend_noflush(name):
-    run(f"dmsetup suspend --noflush {name}")
+    backend().suspend(name, noflush=True)
 
 
 def resume(name):
-    run(f"dmsetup resume {name}")
+    backend().resume(name)
 
 
 def remove(name):
-    def _remove():
-        run(f"dmsetup remove {name}")
-
-    # udev is slow and sometimes prevents remove from completing
-    utils.retry_if_fails(_remove, max_retries=4, retry_delay=0.5)
+    # both backends wait for udev, and retry if it has the device open
+    backend().remove(name)
 
 
 def message(name, sector, *args):
-    (_, stdout, _) = run(f"dmsetup message {name} {sector} {' '.join(args)}")
-    return stdout
+    return backend().message(name, sector, " ".join(args))
+
+
+class MessageError(Exception):
+    """
+    Raised by messages() if any message failed.  'failures' holds a
+    (message, exception) pair for each failure, and 'results' the output
+    of every message, with None for those that failed or weren't sent.
+    """
+
+    def __init__(self, name, failures, results, nr_sent=None):
+        lines = "\n".join(f"  '{msg}': {e}" for msg, e in failures)
+        unsent = ""
+        if nr_sent is not None and nr_sent < len(results):
+            unsent = f", {len(results) - nr_sent} not sent"
+        super().__init__(
+            f"{len(failures)} of {len(results)} messages to {name} failed{unsent}:\n{lines}"
+        )
+        self.failures = failures
+        self.results = results
+
+
+def messages(name, sector, msgs, stop_on_error=False):
+    """
+    Sends each message in turn, carrying on past failures unless
+    'stop_on_error' is set, as it should be when later messages depend on
+    earlier ones.  Returns the output of each message, or raises
+    MessageError if any failed.
+    """
+    msgs = list(msgs)
+    results = backend().messages(name, sector, msgs, stop_on_error=stop_on_error)
+    failures = [(msg, e) for msg, (_, e) in zip(msgs, results) if e is not None]
+    outputs = [out for out, _ in results]
+    if failures:
+        nr_sent = len(outputs)
+        outputs += [None] * (len(msgs) - nr_sent)
+        raise MessageError(name, failures, outputs, nr_sent)
+    return outputs
+
+
+STATUS_ARGS = {"--noflush", "-v"}
 
 
 def status(name, *args):
-    (_, stdout, _) = run(f"dmsetup status {' '.join(args)} {name}")
-    return stdout
+    unknown = [a for a in args if a not in STATUS_ARGS]
+    if unknown:
+        raise ValueError(f"unsupported status arguments: {' '.join(unknown)}")
+    return backend().status(name, noflush="--noflush" in args, verbose="-v" in args)
 
 
 def table(name):
-    run(f"dmsetup table {name}")
+    return backend().table(name)
 
 
 def info(name):
-    run(f"dmsetup info {name}")
+    return backend().info(name)
 
 
 def parse_event_nr(txt):
-    m = re.search(r"Event number:[ \t]*([0-9+])", txt)
+    m = re.search(r"Event number:[ \t]*([0-9]+)", txt)
     if not m:
         raise ValueError("Output does not contain an event number")
 
     return int(m.group(1))
 
 
+def event_nr(name):
+    return parse_event_nr(backend().info(name))
+
+
 def wait(name, event_nr):
-    (_, stdout, _) = run(f"dmsetup wait -v {name} {event_nr}")
-    return parse_event_nr(stdout)
+    return parse_event_nr(backend().wait(name, event_nr))
+
+
+def wait_for(predicate, timeout=None, interval=1.0):
+    """
+    Calls predicate() until it returns a true value, which is returned.
+    It's called again whenever a device-mapper event is raised, or after
+    'interval' seconds, for changes that don't raise events.  Raises
+    TimeoutError if 'timeout' seconds pass first.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    with backend().event_poller() as poller:
+        while True:
+            poller.arm()
+            r = predicate()
+            if r:
+                return r
+
+            delay = interval
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"condition not met within {timeout}s")
+                delay = min(delay, remaining)
+            poller.wait(delay)
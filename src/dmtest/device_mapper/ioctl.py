@@ -0,0 +1,444 @@
+import errno
+import fcntl
+import logging as log
+import os
+import select
+import struct
+import time
+
+import dmtest.command_trace as command_trace
+import dmtest.udev as udev
+
+from dmtest.device_mapper.table import format_entries
+
+# Device-mapper backend that issues ioctls on /dev/mapper/control directly,
+# rather than running dmsetup.  See include/uapi/linux/dm-ioctl.h.
+
+CONTROL = "/dev/mapper/control"
+
+# The interface version we speak.  The kernel accepts any 4.x.
+VERSION = (4, 0, 0)
+
+# struct dm_ioctl
+_header = struct.Struct("=3IIIIiIIIQ128s129s7s")
+
+# struct dm_target_spec
+_target_spec = struct.Struct("=QQiI16s")
+
+# struct dm_target_msg, followed by the message itself
+_target_msg = struct.Struct("=Q")
+
+# ioctl numbers
+DM_VERSION = 0
+DM_DEV_CREATE = 3
+DM_DEV_REMOVE = 4
+DM_DEV_SUSPEND = 6
+DM_DEV_STATUS = 7
+DM_DEV_WAIT = 8
+DM_TABLE_LOAD = 9
+DM_TABLE_STATUS = 12
+DM_TARGET_MSG = 14
+DM_DEV_ARM_POLL = 16
+
+# dm_ioctl.flags
+DM_READONLY_FLAG = 1 << 0
+DM_SUSPEND_FLAG = 1 << 1
+DM_STATUS_TABLE_FLAG = 1 << 4
+DM_ACTIVE_PRESENT_FLAG = 1 << 5
+DM_INACTIVE_PRESENT_FLAG = 1 << 6
+DM_BUFFER_FULL_FLAG = 1 << 8
+DM_NOFLUSH_FLAG = 1 << 11
+DM_DATA_OUT_FLAG = 1 << 16
+
+# Initial size of the buffer passed to the kernel.  Doubled, and the ioctl
+# reissued, if the result doesn't fit.
+BUFFER_SIZE = 16 * 1024
+
+# Messages have side effects, so can't be reissued with a bigger buffer.
+MESSAGE_BUFFER_SIZE = 64 * 1024
+
+# A remove that fails with EBUSY is retried once whatever had the device
+# open, usually udev probing it after it was last closed for writing, is
+# done with it.
+REMOVE_ATTEMPTS = 10
+BUSY_TIMEOUT = 0.5
+
+_control_fd = None
+
+
+def _iowr(nr):
+    # _IOWR(DM_IOCTL, nr, struct dm_ioctl)
+    return (3 << 30) | (_header.size << 16) | (0xFD << 8) | nr
+
+
+def _control():
+    global _control_fd
+    if _control_fd is None:
+        _control_fd = os.open(CONTROL, os.O_RDWR | os.O_CLOEXEC)
+    return _control_fd
+
+
+def available():
+    """
+    True if /dev/mapper/control can be opened, and speaks a version of the
+    interface we understand.
+    """
+    try:
+        r = _ioctl(DM_VERSION, "", "version")
+    except OSError:
+        return False
+    return r.version[0] == VERSION[0]
+
+
+class _Result:
+    def __init__(self, buf):
+        fields = _header.unpack_from(buf, 0)
+        self.buf = buf
+        self.version = fields[0:3]
+        self.data_start = fields[4]
+        self.target_count = fields[5]
+        self.open_count = fields[6]
+        self.flags = fields[7]
+        self.event_nr = fields[8]
+        self.dev = fields[10]
+        self.name = _cstr(fields[11])
+        self.uuid = _cstr(fields[12])
+
+    def targets(self):
+        """
+        Yields (start_sector, sector_count, type, params) for each target
+        in a DM_TABLE_STATUS result.
+        """
+        base = self.data_start
+        offset = base
+        for _ in range(self.target_count):
+            start, length, _, next, type = _target_spec.unpack_from(self.buf, offset)
+            params_start = offset + _target_spec.size
+            params_end = self.buf.index(b"\0", params_start)
+            params = self.buf[params_start:params_end].decode()
+            yield (start, length, _cstr(type), params)
+            # relative to the start of the data area, unlike DM_TABLE_LOAD
+            offset = base + next
+
+    def data(self):
+        """
+        The NUL terminated string returned by DM_TARGET_MSG, if any.
+        """
+        if not self.flags & DM_DATA_OUT_FLAG:
+            return ""
+        end = self.buf.index(b"\0", self.data_start)
+        return self.buf[self.data_start : end].decode()
+
+
+def _cstr(b):
+    return b.split(b"\0", 1)[0].decode()
+
+
+def _align8(n):
+    return (n + 7) & ~7
+
+
+def _ioctl(
+    nr,
+    name,
+    op,
+    flags=0,
+    event_nr=0,
+    target_count=0,
+    payload=b"",
+    size=BUFFER_SIZE,
+    retry=True,
+    fd=None,
+):
+    if fd is None:
+        fd = _control()
+
+    # recorded alongside the commands run, so the two backends can be
+    # compared
+    with command_trace.timed("dm-ioctl", f"{op} {name}"):
+        return _ioctl_retry(
+            nr, name, op, flags, event_nr, target_count, payload, size, retry, fd
+        )
+
+
+def _ioctl_retry(
+    nr, name, op, flags, event_nr, target_count, payload, size, retry, fd
+):
+    while True:
+        size = max(size, _header.size + len(payload))
+        buf = bytearray(size)
+        _header.pack_into(
+            buf,
+            0,
+            *VERSION,
+            size,
+            _header.size,
+            target_count,
+            0,
+            flags,
+            event_nr,
+            0,
+            0,
+            name.encode(),
+            b"",
+            b"",
+        )
+        buf[_header.size : _header.size + len(payload)] = payload
+
+        try:
+            fcntl.ioctl(fd, _iowr(nr), buf, True)
+        except OSError as e:
+            raise OSError(e.errno, f"dm {op} {name} failed: {e.strerror}") from None
+
+        r = _Result(bytes(buf))
+        if not r.flags & DM_BUFFER_FULL_FLAG:
+            return r
+        if not retry:
+            raise OSError(
+                errno.ENOSPC, f"dm {op} {name} failed: result larger than {size} bytes"
+            )
+        size *= 2
+
+
+def _target_specs(entries):
+    specs = bytearray()
+    count = 0
+    for start, length, type, params in entries:
+        p = params.encode() + b"\0"
+        next = _align8(_target_spec.size + len(p))
+        spec = bytearray(next)
+        # 'next' is relative to this spec
+        _target_spec.pack_into(spec, 0, start, length, 0, next, type.encode())
+        spec[_target_spec.size : _target_spec.size + len(p)] = p
+        specs += spec
+        count += 1
+    return (count, bytes(specs))
+
+
+def _udev_wait(mon, action, name, dev):
+    if not mon.wait(action, dev):
+        log.warning(f"timed out waiting for udev to process {action} of {name}")
+
+
+def _registered(dev):
+    return os.path.exists(f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}")
+
+
+def create(name):
+    # Since Linux 5.15 the disk isn't added until the first table load,
+    # so there's no uevent to wait for here.  /dev/mapper/<name> is left
+    # to udev, which creates it when the device is first resumed.
+    log.info(f"dm create {name}")
+    _ioctl(DM_DEV_CREATE, name, "create")
+
+
+def load(name, table, read_only=False):
+    # render the target args once, for both the log and the ioctl
+    entries = list(table.entries())
+    ro = " (read only)" if read_only else ""
+    log.info(f"dm load {name}{ro}:\n{format_entries(entries)}")
+    count, specs = _target_specs(entries)
+    flags = DM_READONLY_FLAG if read_only else 0
+
+    # older kernels added the disk when the device was created
+    dev = _ioctl(DM_DEV_STATUS, name, "load").dev
+    if _registered(dev):
+        _ioctl(
+            DM_TABLE_LOAD, name, "load", flags=flags, target_count=count, payload=specs
+        )
+        return
+
+    with udev.UeventMonitor() as mon:
+        _ioctl(
+            DM_TABLE_LOAD, name, "load", flags=flags, target_count=count, payload=specs
+        )
+        _udev_wait(mon, "add", name, dev)
+
+
+def suspend(name, noflush=False):
+    log.info(f"dm suspend {'--noflush ' if noflush else ''}{name}")
+    flags = DM_SUSPEND_FLAG
+    if noflush:
+        flags |= DM_NOFLUSH_FLAG
+    _ioctl(DM_DEV_SUSPEND, name, "suspend", flags=flags)
+
+
+def resume(name):
+    log.info(f"dm resume {name}")
+
+    # the kernel only sends a uevent if the device was suspended, which it
+    # will be to swap in an inactive table
+    before = _ioctl(DM_DEV_STATUS, name, "resume")
+    changing = before.flags & (DM_SUSPEND_FLAG | DM_INACTIVE_PRESENT_FLAG)
+
+    with udev.UeventMonitor() as mon:
+        r = _ioctl(DM_DEV_SUSPEND, name, "resume")
+        if changing:
+            _udev_wait(mon, "change", name, r.dev)
+
+
+def remove(name):
+    log.info(f"dm remove {name}")
+    dev = _ioctl(DM_DEV_STATUS, name, "remove").dev
+
+    with udev.UeventMonitor() as mon:
+        for attempt in range(REMOVE_ATTEMPTS):
+            try:
+                _ioctl(DM_DEV_REMOVE, name, "remove")
+                break
+            except OSError as e:
+                if e.errno != errno.EBUSY or attempt == REMOVE_ATTEMPTS - 1:
+                    raise
+                log.info(f"{name} is busy, retrying remove")
+                if mon.active:
+                    mon.wait(None, dev, timeout=BUSY_TIMEOUT)
+                else:
+                    time.sleep(BUSY_TIMEOUT)
+        _udev_wait(mon, "remove", name, dev)
+
+
+def _message(name, sector, msg):
+    payload = _target_msg.pack(sector) + msg.encode() + b"\0"
+    r = _ioctl(
+        DM_TARGET_MSG,
+        name,
+        "message",
+        payload=payload,
+        size=MESSAGE_BUFFER_SIZE,
+        retry=False,
+    )
+    return r.data().strip()
+
+
+def message(name, sector, msg):
+    log.info(f"dm message {name} {sector} {msg}")
+    out = _message(name, sector, msg)
+    if out:
+        log.info(f"stdout:\n{out}")
+    return out
+
+
+def messages(name, sector, msgs, stop_on_error=False):
+    msgs = list(msgs)
+    log.info(f"dm message {name} {sector}, {len(msgs)} messages:\n" + "\n".join(msgs))
+    results = []
+    for msg in msgs:
+        try:
+            results.append((_message(name, sector, msg), None))
+        except OSError as e:
+            results.append((None, e))
+            if stop_on_error:
+                break
+    return results
+
+
+def _format_targets(r):
+    return "\n".join(
+        f"{start} {length} {type} {params}"
+        for start, length, type, params in r.targets()
+    )
+
+
+def _format_info(r):
+    if r.flags & DM_SUSPEND_FLAG:
+        state = "SUSPENDED"
+    else:
+        state = "ACTIVE"
+    if r.flags & DM_READONLY_FLAG:
+        state += " (READ-ONLY)"
+
+    tables = []
+    if r.flags & DM_ACTIVE_PRESENT_FLAG:
+        tables.append("LIVE")
+    if r.flags & DM_INACTIVE_PRESENT_FLAG:
+        tables.append("INACTIVE")
+
+    lines = [
+        f"Name:              {r.name}",
+        f"State:             {state}",
+        f"Tables present:    {' & '.join(tables) or 'None'}",
+        f"Open count:        {r.open_count}",
+        f"Event number:      {r.event_nr}",
+        f"Major, minor:      {os.major(r.dev)}, {os.minor(r.dev)}",
+        f"Number of targets: {r.target_count}",
+    ]
+    if r.uuid:
+        lines.append(f"UUID: {r.uuid}")
+    return "\n".join(lines)
+
+
+def status(name, noflush=False, verbose=False):
+    log.info(f"dm status {'--noflush ' if noflush else ''}{name}")
+    flags = DM_NOFLUSH_FLAG if noflush else 0
+    r = _ioctl(DM_TABLE_STATUS, name, "status", flags=flags)
+    out = _format_targets(r)
+    if verbose:
+        out = f"{_format_info(r)}\n\n{out}"
+    log.info(f"stdout:\n{out}")
+    return out
+
+
+def table(name):
+    log.info(f"dm table {name}")
+    r = _ioctl(DM_TABLE_STATUS, name, "table", flags=DM_STATUS_TABLE_FLAG)
+    out = _format_targets(r)
+    log.info(f"stdout:\n{out}")
+    return out
+
+
+def info(name):
+    r = _ioctl(DM_DEV_STATUS, name, "info")
+    return _format_info(r)
+
+
+class EventPoller:
+    """
+    Blocks until any device-mapper device raises an event, eg. a thin
+    pool passing its low water mark, or a timeout expires.
+
+    arm() before checking whatever you're waiting for, then wait(), so an
+    event raised in between isn't missed.  Kernels without
+    DM_DEV_ARM_POLL just get the timeout.
+    """
+
+    def __init__(self):
+        self._fd = os.open(CONTROL, os.O_RDWR | os.O_CLOEXEC)
+        self._supported = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _exc_type, _exc_value, _traceback):
+        self.close()
+
+    def close(self):
+        os.close(self._fd)
+
+    def arm(self):
+        if not self._supported:
+            return
+        try:
+            _ioctl(DM_DEV_ARM_POLL, "", "arm poll", size=_header.size, fd=self._fd)
+        except OSError as e:
+            if e.errno not in (errno.ENOTTY, errno.EINVAL):
+                raise
+            log.info("kernel doesn't support DM_DEV_ARM_POLL, polling on a timer")
+            self._supported = False
+
+    def wait(self, timeout):
+        if not self._supported:
+            time.sleep(timeout)
+            return
+        poller = select.poll()
+        poller.register(self._fd, select.POLLIN)
+        poller.poll(timeout * 1000)
+
+
+def event_poller():
+    return EventPoller()
+
+
+def wait(name, event_nr):
+    log.info(f"dm wait {name} {event_nr}")
+    r = _ioctl(DM_DEV_WAIT, name, "wait", event_nr=event_nr)
+    return _format_info(r)
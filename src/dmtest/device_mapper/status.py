@@ -0,0 +1,356 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+# Typed parsers for the status lines of the targets we test.  Each class
+# is built from the params of a single status line, ie. what follows
+# '<start> <length> <type>'.  See Documentation/admin-guide/device-mapper
+# in the kernel tree for the formats.
+
+
+def _usage(txt) -> Tuple[int, int]:
+    (used, total) = txt.split("/")
+    return (int(used), int(total))
+
+
+def _optional_int(txt) -> Optional[int]:
+    return None if txt == "-" else int(txt)
+
+
+def _check_failed(type, tokens):
+    if tokens and tokens[0] in ("Fail", "Error"):
+        raise ValueError(f"{type} target has failed: {' '.join(tokens)}")
+
+
+@dataclass
+class ThinPoolStatus:
+    __slots__ = (
+        "transaction_id",
+        "metadata_used",
+        "metadata_total",
+        "data_used",
+        "data_total",
+        "metadata_snap",
+        "mode",
+        "block_zeroing",
+        "ignore_discard",
+        "discard_passdown",
+        "error_if_no_space",
+        "needs_check",
+        "metadata_threshold",
+    )
+
+    transaction_id: int
+    metadata_used: int
+    metadata_total: int
+    data_used: int
+    data_total: int
+    metadata_snap: Optional[int]
+    mode: str
+    block_zeroing: bool
+    ignore_discard: bool
+    discard_passdown: bool
+    error_if_no_space: bool
+    needs_check: bool
+    metadata_threshold: int
+
+    @classmethod
+    def parse(cls, tokens: List[str]) -> "ThinPoolStatus":
+        _check_failed("thin-pool", tokens)
+
+        block_zeroing = True
+        ignore_discard = False
+        discard_passdown = True
+        mode = "read-only"
+        error_if_no_space = False
+
+        for t in tokens[4:-2]:
+            if t == "skip_block_zeroing":
+                block_zeroing = False
+            elif t == "ignore_discard":
+                ignore_discard = True
+            elif t == "no_discard_passdown":
+                discard_passdown = False
+            elif t == "discard_passdown":
+                discard_passdown = True
+            elif t == "out_of_data_space":
+                mode = "out-of-data-space"
+            elif t == "ro":
+                mode = "read-only"
+            elif t == "rw":
+                mode = "read-write"
+            elif t == "error_if_no_space":
+                error_if_no_space = True
+            elif t == "queue_if_no_space":
+                error_if_no_space = False
+            else:
+                raise ValueError(f"Bad pool option {t}")
+
+        metadata_used, metadata_total = _usage(tokens[1])
+        data_used, data_total = _usage(tokens[2])
+        return cls(
+            transaction_id=int(tokens[0]),
+            metadata_used=metadata_used,
+            metadata_total=metadata_total,
+            data_used=data_used,
+            data_total=data_total,
+            metadata_snap=_optional_int(tokens[3]),
+            mode=mode,
+            block_zeroing=block_zeroing,
+            ignore_discard=ignore_discard,
+            discard_passdown=discard_passdown,
+            error_if_no_space=error_if_no_space,
+            needs_check=tokens[-2] == "needs_check",
+            metadata_threshold=int(tokens[-1]),
+        )
+
+
+@dataclass
+class ThinStatus:
+    __slots__ = ("mapped_sectors", "highest_mapped_sector")
+
+    mapped_sectors: int
+    highest_mapped_sector: Optional[int]
+
+    @classmethod
+    def parse(cls, tokens: List[str]) -> "ThinStatus":
+        _check_failed("thin", tokens)
+        return cls(
+            mapped_sectors=int(tokens[0]),
+            highest_mapped_sector=_optional_int(tokens[1]),
+        )
+
+
+@dataclass
+class CacheStatus:
+    __slots__ = (
+        "metadata_block_size",
+        "metadata_used",
+        "metadata_total",
+        "block_size",
+        "cache_used",
+        "cache_total",
+        "read_hits",
+        "read_misses",
+        "write_hits",
+        "write_misses",
+        "demotions",
+        "promotions",
+        "dirty",
+        "features",
+        "core_args",
+        "policy",
+        "policy_args",
+        "metadata_mode",
+        "needs_check",
+    )
+
+    metadata_block_size: int
+    metadata_used: int
+    metadata_total: int
+    block_size: int
+    cache_used: int
+    cache_total: int
+    read_hits: int
+    read_misses: int
+    write_hits: int
+    write_misses: int
+    demotions: int
+    promotions: int
+    dirty: int
+    features: List[str]
+    core_args: Dict[str, str]
+    policy: str
+    policy_args: Dict[str, str]
+    metadata_mode: str
+    needs_check: bool
+
+    @classmethod
+    def parse(cls, tokens: List[str]) -> "CacheStatus":
+        _check_failed("cache", tokens)
+
+        metadata_used, metadata_total = _usage(tokens[1])
+        cache_used, cache_total = _usage(tokens[3])
+        (
+            read_hits,
+            read_misses,
+            write_hits,
+            write_misses,
+            demotions,
+            promotions,
+            dirty,
+        ) = [int(t) for t in tokens[4:11]]
+
+        # variable length sections, each preceded by its length
+        pos = 11
+        nr_features = int(tokens[pos])
+        features = tokens[pos + 1 : pos + 1 + nr_features]
+        pos += 1 + nr_features
+
+        nr_core_args = int(tokens[pos])
+        core = tokens[pos + 1 : pos + 1 + nr_core_args]
+        pos += 1 + nr_core_args
+
+        policy = tokens[pos]
+        nr_policy_args = int(tokens[pos + 1])
+        policy_args = tokens[pos + 2 : pos + 2 + nr_policy_args]
+        pos += 2 + nr_policy_args
+
+        return cls(
+            metadata_block_size=int(tokens[0]),
+            metadata_used=metadata_used,
+            metadata_total=metadata_total,
+            block_size=int(tokens[2]),
+            cache_used=cache_used,
+            cache_total=cache_total,
+            read_hits=read_hits,
+            read_misses=read_misses,
+            write_hits=write_hits,
+            write_misses=write_misses,
+            demotions=demotions,
+            promotions=promotions,
+            dirty=dirty,
+            features=features,
+            core_args=dict(zip(core[0::2], core[1::2])),
+            policy=policy,
+            policy_args=dict(zip(policy_args[0::2], policy_args[1::2])),
+            metadata_mode=tokens[pos],
+            needs_check=tokens[pos + 1] == "needs_check",
+        )
+
+
+@dataclass
+class EraStatus:
+    __slots__ = (
+        "metadata_block_size",
+        "metadata_used",
+        "metadata_total",
+        "current_era",
+        "metadata_snap",
+    )
+
+    metadata_block_size: int
+    metadata_used: int
+    metadata_total: int
+    current_era: int
+    metadata_snap: Optional[int]
+
+    @classmethod
+    def parse(cls, tokens: List[str]) -> "EraStatus":
+        _check_failed("era", tokens)
+        metadata_used, metadata_total = _usage(tokens[1])
+        return cls(
+            metadata_block_size=int(tokens[0]),
+            metadata_used=metadata_used,
+            metadata_total=metadata_total,
+            current_era=int(tokens[2]),
+            metadata_snap=_optional_int(tokens[3]),
+        )
+
+
+@dataclass
+class VDOStatus:
+    __slots__ = (
+        "storage_device",
+        "mode",
+        "recovery_mode",
+        "index_state",
+        "compress_state",
+        "blocks_used",
+        "blocks_total",
+    )
+
+    storage_device: str
+    mode: str
+    recovery_mode: str
+    index_state: str
+    compress_state: str
+    blocks_used: int
+    blocks_total: int
+
+    @classmethod
+    def parse(cls, tokens: List[str]) -> "VDOStatus":
+        return cls(
+            storage_device=tokens[0],
+            mode=tokens[1],
+            recovery_mode=tokens[2],
+            index_state=tokens[3],
+            compress_state=tokens[4],
+            blocks_used=int(tokens[5]),
+            blocks_total=int(tokens[6]),
+        )
+
+
+@dataclass
+class WriteCacheStatus:
+    __slots__ = ("error", "blocks", "free_blocks", "writeback_blocks", "counters")
+
+    error: int
+    blocks: int
+    free_blocks: int
+    writeback_blocks: int
+
+    # read/write hit counters etc., only reported by newer kernels
+    counters: List[int]
+
+    @classmethod
+    def parse(cls, tokens: List[str]) -> "WriteCacheStatus":
+        return cls(
+            error=int(tokens[0]),
+            blocks=int(tokens[1]),
+            free_blocks=int(tokens[2]),
+            writeback_blocks=int(tokens[3]),
+            counters=[int(t) for t in tokens[4:]],
+        )
+
+
+@dataclass
+class OtherStatus:
+    """
+    Status of a target without a parser, eg. linear.
+    """
+
+    __slots__ = ("type", "params")
+
+    type: str
+    params: str
+
+
+PARSERS = {
+    "thin-pool": ThinPoolStatus.parse,
+    "thin": ThinStatus.parse,
+    "cache": CacheStatus.parse,
+    "era": EraStatus.parse,
+    "vdo": VDOStatus.parse,
+    "writecache": WriteCacheStatus.parse,
+}
+
+
+def parse_line(line: str):
+    fields = line.split(None, 3)
+    type = fields[2]
+    params = fields[3] if len(fields) > 3 else ""
+    parser = PARSERS.get(type)
+    if parser is None:
+        return OtherStatus(type, params)
+    return parser(params.split())
+
+
+def parse_status(txt: str) -> List:
+    """
+    Parses the output of a status call, returning one object per target.
+    """
+    return [parse_line(line) for line in txt.splitlines() if line.strip()]
+
+
+def target_status(dev, cls, noflush=False):
+    """
+    The parsed status of a single target device, checking it is of the
+    expected type.
+    """
+    statuses = dev.parsed_status(noflush)
+    if len(statuses) != 1:
+        raise ValueError(f"expected a single target in {dev}, got {len(statuses)}")
+    s = statuses[0]
+    if not isinstance(s, cls):
+        raise ValueError(f"{dev} status is {type(s).__name__}, expected {cls.__name__}")
+    return s
@@ -8,12 +8,23 @@ class Table:
     def __iter__(self):
         return iter(self._targets)
 
-    def table_lines(self):
+    def entries(self):
+        """
+        Yields (start_sector, sector_count, type, params) for each target.
+        """
         start_sector = 0
-        lines = []
         for t in self._targets:
             args = " ".join(map(str, t.args))
-            line = f"{start_sector} {t.sector_count} {t.type} {args}"
-            lines.append(line)
+            yield (start_sector, t.sector_count, t.type, args)
             start_sector += t.sector_count
-        return "\n".join(lines)
+
+    def table_lines(self):
+        return format_entries(self.entries())
+
+
+def format_entries(entries):
+    lines = []
+    for start_sector, sector_count, type, args in entries:
+        line = f"{start_sector} {sector_count} {type} {args}"
+        lines.append(line)
+    return "\n".join(lines)
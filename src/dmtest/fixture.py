@@ -1,4 +1,10 @@
 import dmtest.config as config
+import dmtest.db as db
+import dmtest.sampler as sampler
+import logging as log
+
+from contextlib import contextmanager
+from typing import List
 
 
 class Fixture:
@@ -6,9 +12,42 @@ class Fixture:
     def __str__(self):
         return str(self._cfg)
 
-    def __init__(self):
-        self._cfg = config.read_config()
+    def __init__(self, cfg=None):
+        self._cfg = cfg if cfg is not None else config.read_config()
+        self._metrics = {}
+        self._series = {}
 
     @property
     def cfg(self):
         return self._cfg
+
+    def record_metric(self, name: str, value: float, unit: str = ""):
+        """
+        Records a numeric result, eg. throughput, to be stored alongside
+        the pass/fail status of the test.  Recording the same name twice
+        replaces the earlier value.
+        """
+        log.info(f"metric {name} = {value} {unit}".rstrip())
+        self._metrics[name] = db.Metric(name, float(value), unit)
+
+    @property
+    def metrics(self) -> List[db.Metric]:
+        return list(self._metrics.values())
+
+    @contextmanager
+    def sampler(self, interval=sampler.DEFAULT_INTERVAL):
+        """
+        Yields a Sampler, running until the block exits.  The series it
+        collects are stored alongside the test result.
+        """
+        s = sampler.Sampler(interval)
+        try:
+            with s:
+                yield s
+        finally:
+            for series in s.series:
+                self._series[series.name] = series
+
+    @property
+    def series(self) -> List[db.Series]:
+        return list(self._series.values())
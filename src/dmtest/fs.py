@@ -1,4 +1,5 @@
 import dmtest.process as process
+import dmtest.utils as utils
 
 from contextlib import contextmanager
 import os
@@ -36,7 +37,7 @@ class BaseFS:
         self.check()
 
     def check(self):
-        process.run("echo 1 > /proc/sys/vm/drop_caches")
+        utils.drop_caches(1)
         process.run(self.check_cmd())
 
     @contextmanager
@@ -1,10 +1,14 @@
 """ Write test data to a device or file"""
+import dmtest.geometry as geometry
 import dmtest.process as process
 
 import logging
+import mmap
 import os
 import struct
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import List
 
@@ -14,6 +18,46 @@ import numpy
 # Each data stream is identified by an 8 character tag
 MAX_TAG_SIZE = 8
 
+# Blocks are generated, written and verified this many bytes at a time
+BATCH_SIZE = 4 * 1024 * 1024
+
+# The number of batches being written at once
+QUEUE_DEPTH = 4
+
+def batch_blocks(block_size: int, batch_size: int = BATCH_SIZE) -> int:
+    """The number of blocks in a batch"""
+    return max(1, batch_size // block_size)
+
+# O_DIRECT needs buffers, offsets and lengths aligned to the logical block
+# size.  Block devices are asked for theirs; this is assumed for files.
+DIRECT_ALIGNMENT = 512
+
+def aligned_buffer(size: int) -> mmap.mmap:
+    """A page aligned buffer, suitable for O_DIRECT
+
+    It's unmapped once garbage collected; closing it explicitly fails while
+    numpy arrays or memoryviews still refer to it.
+    """
+    return mmap.mmap(-1, size)
+
+def pwrite_all(fd: int, data, offset: int):
+    """Write all of a buffer at the given offset, whatever the short writes"""
+    view = memoryview(data).cast('B')
+    done = 0
+    while done < len(view):
+        done += os.pwritev(fd, [view[done:]], offset + done)
+
+def pread_all(fd: int, buffer, offset: int) -> int:
+    """Fill a buffer from the given offset, returning the bytes read"""
+    view = memoryview(buffer)
+    done = 0
+    while done < len(view):
+        n = os.preadv(fd, [view[done:]], offset + done)
+        if n == 0:
+            break
+        done += n
+    return done
+
 def shrink_for_dedupe(number: int, dedupe: float) -> int:
     """Calculate the block number for the Header.
 
@@ -42,6 +86,124 @@ def shrink_for_dedupe(number: int, dedupe: float) -> int:
         number = number >> 1
     return number
 
+def shrink_batch_for_dedupe(numbers: numpy.ndarray, dedupe: float) -> numpy.ndarray:
+    """shrink_for_dedupe() applied to an array of block numbers"""
+    numbers = numbers.astype(numpy.int64)
+    while True:
+        shrink = (numbers > 0) & ((numbers * dedupe) % 1 < dedupe)
+        if not shrink.any():
+            return numbers
+        numbers[shrink] >>= 1
+
+# numpy.random.SeedSequence constants
+_INIT_A = 0x43b0d7e5
+_MULT_A = 0x931e8875
+_INIT_B = 0x8b51f9dd
+_MULT_B = 0x58f38ded
+_MIX_MULT_L = numpy.uint32(0xca01f9dd)
+_MIX_MULT_R = numpy.uint32(0x4973f715)
+_XSHIFT = numpy.uint32(16)
+_MASK32 = 0xffffffff
+
+# PCG64's 128 bit LCG multiplier
+_PCG_MULT = 0x2360ed051fc65da44385df649fccf645
+_MASK128 = (1 << 128) - 1
+
+def _mix(x, y):
+    result = _MIX_MULT_L * x - _MIX_MULT_R * y
+    return result ^ (result >> _XSHIFT)
+
+def pcg64_states(words: numpy.ndarray) -> List[dict]:
+    """The state of numpy.random.default_rng(seed) for many seeds at once
+
+    Running numpy's SeedSequence over a whole batch of seeds, rather than
+    building a generator for each block, is most of the speed up of
+    BlockStream.generate_batch().
+
+    Parameters
+    ----------
+    words : numpy.ndarray
+        (n, 4) uint32 array holding each 128 bit seed, least significant
+        word first
+
+    Returns
+    -------
+    List[dict]
+        a PCG64 state for each seed, as numpy.random.PCG64.state
+    """
+    hash_const = _INIT_A
+
+    def hashmix(value):
+        nonlocal hash_const
+        value = value ^ numpy.uint32(hash_const)
+        hash_const = (hash_const * _MULT_A) & _MASK32
+        value = value * numpy.uint32(hash_const)
+        return value ^ (value >> _XSHIFT)
+
+    # SeedSequence.mix_entropy(), the seed fits in the pool
+    pool = [hashmix(words[:, i]) for i in range(4)]
+    for i_src in range(4):
+        for i_dst in range(4):
+            if i_src != i_dst:
+                pool[i_dst] = _mix(pool[i_dst], hashmix(pool[i_src]))
+
+    # SeedSequence.generate_state(4, numpy.uint64)
+    hash_const = _INIT_B
+    state = []
+    for i in range(8):
+        value = pool[i % 4] ^ numpy.uint32(hash_const)
+        hash_const = (hash_const * _MULT_B) & _MASK32
+        value = value * numpy.uint32(hash_const)
+        state.append((value ^ (value >> _XSHIFT)).tolist())
+
+    # PCG64 seeding, see pcg_setseq_128_srandom_r()
+    states = []
+    for w in zip(*state):
+        initstate = (w[0] | w[1] << 32) << 64 | w[2] | w[3] << 32
+        initseq = (w[4] | w[5] << 32) << 64 | w[6] | w[7] << 32
+        inc = ((initseq << 1) | 1) & _MASK128
+        states.append({'bit_generator': 'PCG64',
+                       'state': {'state': ((inc + initstate) * _PCG_MULT + inc) & _MASK128,
+                                 'inc': inc},
+                       'has_uint32': 0,
+                       'uinteger': 0})
+    return states
+
+_fast_seeding_ok = None
+
+def fast_seeding_ok() -> bool:
+    """Check, once, that pcg64_states() still matches numpy
+
+    pcg64_states() copies numpy's SeedSequence and PCG64 seeding, which
+    numpy is free to change.  If it no longer gives the data the
+    BlockBuffer.fill_data() path does, BlockStream falls back to building a
+    generator for each block, so the data on disk doesn't change.
+
+    Returns
+    -------
+    bool
+        True if pcg64_states() can be used
+    """
+    global _fast_seeding_ok
+    if _fast_seeding_ok is None:
+        _fast_seeding_ok = True
+        ok = True
+        for tag, number, compress in [("a", 0, 0.0), ("abcdefg", 1, 0.5),
+                                      ("zz", 0xffffffff, 0.25)]:
+            stream = BlockStream(tag, 0.0, compress)
+            block_size = 4096
+            batch = stream.generate_batch(number, 1, block_size)
+            block = BlockBuffer(Header(tag, stream.number, number))
+            block.fill_data(int(compress * block_size), block_size)
+            if batch.tobytes() != block.to_bytes():
+                ok = False
+                break
+        if not ok:
+            logging.warning("numpy's seeding has changed, generating each block's data"
+                            " with its own generator")
+        _fast_seeding_ok = ok
+    return _fast_seeding_ok
+
 class CompareError(Exception):
     """ Exception raised for full data compare errors """
     def __init__(self,
@@ -76,6 +238,10 @@ class ClaimError(Exception):
 
 HEADER_FORMAT = "!8sIL"
 
+# HEADER_FORMAT as a numpy dtype, for stamping headers on a whole batch
+HEADER_DTYPE = numpy.dtype([('tag', 'S8'), ('stream_number', '>u4'),
+                            ('block_number', '>u4')])
+
 class Header:
     """Header of what is written to and read from disk
 
@@ -200,6 +366,19 @@ class DataStream:
     def generate(self, block_number: int, block_size: int) -> bytes:
         raise NotImplementedError("method generate must be implemented")
 
+    def generate_batch(self, block_number: int, count: int,
+                       block_size: int) -> numpy.ndarray:
+        """Generate 'count' consecutive buffers, starting at block_number
+
+        Returns
+        -------
+        numpy.ndarray
+            a (count, block_size) array of bytes
+        """
+        data = b"".join(self.generate(block_number + n, block_size)
+                        for n in range(count))
+        return numpy.frombuffer(data, dtype=numpy.uint8).reshape(count, block_size)
+
     def report(self) -> str:
         raise NotImplementedError("method report must be implemented")
 
@@ -213,6 +392,7 @@ class BlockStream(DataStream):
         self.dedupe = dedupe
         self.compress = compress
         self.number = 0
+        self._bit_generator = numpy.random.PCG64()
         super().__init__()
 
     def claim(self, buffer):
@@ -251,13 +431,74 @@ class BlockStream(DataStream):
         bytes
             the bytes array
         """
-        number = shrink_for_dedupe(block_number, self.dedupe)
-        header = Header(self.tag, self.number, number)
-        block = BlockBuffer(header)
-        # Fill the block with ones for compress and rest with random data
-        compress = int(self.compress * block_size)
-        block.fill_data(compress, block_size)
-        return block.to_bytes()
+        return self.generate_batch(block_number, 1, block_size).tobytes()
+
+    def generate_batch(self, block_number, count, block_size):
+        """Generate 'count' consecutive buffers, starting at block_number
+
+        The result is the same as building a BlockBuffer for each block,
+        but the headers, dedupe and compressible data are done for the
+        whole batch at once, and the random data for each unique header
+        is generated straight into the batch.  The random data is seeded
+        with pcg64_states(), unless fast_seeding_ok() finds it no longer
+        matches numpy.
+
+        Parameters
+        ----------
+        block_number : int
+            location in the BlockStream of the first buffer
+        count : int
+            the number of buffers to generate
+        block_size : int
+            size of each buffer
+
+        Returns
+        -------
+        numpy.ndarray
+            a (count, block_size) array of bytes
+        """
+        numbers = shrink_batch_for_dedupe(
+            numpy.arange(block_number, block_number + count), self.dedupe)
+        if self.dedupe > 0:
+            # Deduplicated blocks share a header, and so their data
+            unique, inverse = numpy.unique(numbers, return_inverse=True)
+        else:
+            unique, inverse = numbers, None
+
+        headers = numpy.empty(len(unique), dtype=HEADER_DTYPE)
+        headers['tag'] = self.tag.encode('ascii')
+        headers['stream_number'] = self.number
+        headers['block_number'] = unique
+        header_len = HEADER_DTYPE.itemsize
+
+        # Ones for compress and the rest random data, as BlockBuffer.fill_data()
+        rand_start = max(int(self.compress * block_size), header_len)
+        rand_size = block_size - rand_start
+
+        blocks = numpy.empty((len(unique), block_size), dtype=numpy.uint8)
+        blocks[:, :header_len] = headers.view(numpy.uint8).reshape(-1, header_len)
+        blocks[:, header_len:rand_start] = 255
+
+        if fast_seeding_ok():
+            self._fill_random(blocks, headers, rand_start, rand_size)
+        else:
+            for i, header in enumerate(headers):
+                rng = numpy.random.default_rng(int.from_bytes(header.tobytes(), 'big'))
+                blocks[i, rand_start:] = numpy.frombuffer(rng.bytes(rand_size),
+                                                          dtype=numpy.uint8)
+
+        return blocks if inverse is None else blocks[inverse]
+
+    def _fill_random(self, blocks, headers, rand_start, rand_size):
+        # The seed is the header as a big endian number
+        words = headers.view('>u4').reshape(-1, 4)[:, ::-1].astype(numpy.uint32)
+        nr_words = (rand_size + 7) // 8
+        for i, state in enumerate(pcg64_states(words)):
+            # numpy's stubs want the private _PCG64State TypedDict here,
+            # which pcg64_states() can't name; the dicts have its layout.
+            self._bit_generator.state = state  # pyright: ignore[reportAttributeAccessIssue]
+            raw = self._bit_generator.random_raw(nr_words).astype('<u8')
+            blocks[i, rand_start:] = raw.view(numpy.uint8)[:rand_size]
 
     def report(self):
         """Return information about the last write or verify"""
@@ -297,6 +538,10 @@ class ZeroStream(DataStream):
         """
         return b"\0" * block_size
 
+    def generate_batch(self, block_number, count, block_size):
+        """Generate 'count' buffers for the ZeroStream"""
+        return numpy.zeros((count, block_size), dtype=numpy.uint8)
+
     def report(self):
         """Return information about the last write or verify"""
         return "ZERO: " + str(self.counter)
@@ -370,9 +615,29 @@ class BlockRange():
             return path
         raise FileNotFoundError(value)
 
-    def verify(self):
+    def _check_direct(self):
+        """Check the block size suits O_DIRECT on this device
+
+        Block devices need multiples of their logical block size, eg. 4096
+        for VDO.  For files DIRECT_ALIGNMENT is assumed.
+        """
+        alignment = DIRECT_ALIGNMENT
+        if self.path.is_block_device():
+            alignment = geometry.geometry(self.path).logical_block_size
+        if (self.block_size % alignment) != 0:
+            raise ValueError("direct I/O to " + str(self.path)
+                             + " needs a block size that is a multiple of "
+                             + str(alignment))
+
+    def verify(self, direct: bool = False):
         """Verify the data previously written to a block range.
 
+        Parameters
+        ----------
+        direct : bool
+            open the device with O_DIRECT, so the device is read rather
+            than the page cache
+
         Raises
         ------
         ValueError
@@ -383,11 +648,58 @@ class BlockRange():
 
         logging.info(f"verifying {self.block_count*self.block_size} bytes in {self.path} at {self.block_size*self.offset}")
         flags = os.O_RDONLY
-        with os.fdopen(os.open(self.path, flags), "rb") as fd:
-            self._seek(fd)
-            for n in range(0, self.block_count):
-                data = fd.read(self.block_size)
-                self.verify_streams(n, data)
+        if direct:
+            self._check_direct()
+            flags |= os.O_DIRECT
+        batch = batch_blocks(self.block_size)
+        buffer = memoryview(aligned_buffer(batch * self.block_size))
+        fd = os.open(self.path, flags)
+        try:
+            for n in range(0, self.block_count, batch):
+                count = min(batch, self.block_count - n)
+                length = pread_all(fd, buffer[:count * self.block_size],
+                                   self.block_size * (self.offset + n))
+                self.verify_batch(n, count, bytes(buffer[:length]))
+        finally:
+            os.close(fd)
+
+    def verify_batch(self, block_number: int, count: int, actual: bytes):
+        """Verify a run of blocks in a block range
+
+        The whole batch is compared against the stream that claims its first
+        block.  If that doesn't match, each block is checked on its own so
+        the failure is reported for the right block.
+
+        Parameters
+        ----------
+        block_number : int
+            block number of the first block
+        count : int
+            the number of blocks
+        actual : bytes
+            the bytes to compare against
+
+        Raises
+        ------
+        CompareError
+        ClaimError
+
+        """
+        first = actual[:self.block_size]
+        for stream in self.streams:
+            if stream.claim(first):
+                expected = stream.generate_batch(block_number, count, self.block_size)
+                if (len(actual) == expected.size and
+                        numpy.array_equal(expected.reshape(-1),
+                                          numpy.frombuffer(actual, dtype=numpy.uint8))):
+                    stream.counter += count
+                    return
+                break
+
+        for n in range(0, count):
+            start = n * self.block_size
+            self.verify_streams(block_number + n,
+                                actual[start:start + self.block_size])
 
     def verify_streams(self, block_number: int, actual: bytes):
         """Verify all streams related to a specific block in a block range.
@@ -423,9 +735,14 @@ class BlockRange():
               compress: float = 0.0,
               direct: bool = False,
               sync: bool = False,
-              fsync: bool = False):
+              fsync: bool = False,
+              chunk_size: int = BATCH_SIZE,
+              queue_depth: int = QUEUE_DEPTH):
         """Write to a block range
 
+        Blocks are generated a chunk at a time and written with pwritev(),
+        with up to queue_depth chunks in flight while the next is built.
+
         Parameters
         ----------
         tag : str
@@ -435,16 +752,21 @@ class BlockRange():
         compress : float
             how much compressible data to write
         direct : bool
-            open the device with O_DIRECT (not yet implemented)
+            open the device with O_DIRECT, writing from page aligned
+            buffers, so errors such as ENOSPC come back from the write
+            itself rather than a later fsync
         sync : bool
             open the device with O_SYNC
         fsync : bool
             write the device with fsync
+        chunk_size : int
+            bytes written by each pwritev(), rounded down to whole blocks
+        queue_depth : int
+            the number of chunks being written at once
 
         Raises
         ------
         ValueError
-        NotImplementedError
 
         """
         if tag is None:
@@ -458,14 +780,12 @@ class BlockRange():
         if (compress < 0.0) or (compress > 0.96):
             raise ValueError("the compression fraction " + str(compress)
                              + " is invalid")
-        if direct:
-            # Direct I/O requires special handling to ensure proper
-            # alignment of the in-memory buffer being written to the
-            # destination. We don't do that yet.
-            raise NotImplementedError("direct I/O is not yet supported")
         stream = BlockStream(tag, dedupe, compress)
 
         flags = os.O_WRONLY
+        if direct:
+            self._check_direct()
+            flags |= os.O_DIRECT
         if sync:
             flags |= os.O_SYNC
         if self.create:
@@ -473,15 +793,41 @@ class BlockRange():
 
         logging.info(f"writing {self.block_count*self.block_size} bytes tagged \"{tag}\""
                      f" to {self.path} at {self.block_size*self.offset} open flags {flags}")
-        with os.fdopen(os.open(self.path, flags), "r+b") as fd:
-            self._seek(fd)
-            for n in range(0, self.block_count):
-                data = stream.generate(n, self.block_size)
-                fd.write(data)
-                stream.counter += 1
-            fd.flush()
+        if queue_depth < 1:
+            raise ValueError("queue_depth must be at least 1")
+        batch = batch_blocks(self.block_size, chunk_size)
+
+        # With O_DIRECT each chunk is copied into an aligned buffer.  The
+        # chunk using a buffer has always completed by the time it comes
+        # round again, since only queue_depth chunks are in flight.
+        buffers = []
+        if direct:
+            buffers = [aligned_buffer(batch * self.block_size)
+                       for _ in range(queue_depth)]
+
+        fd = os.open(self.path, flags)
+        try:
+            with ThreadPoolExecutor(max_workers=queue_depth) as pool:
+                in_flight = deque()
+                for i, n in enumerate(range(0, self.block_count, batch)):
+                    count = min(batch, self.block_count - n)
+                    data = stream.generate_batch(n, count, self.block_size)
+                    if len(in_flight) == queue_depth:
+                        in_flight.popleft().result()
+                    if buffers:
+                        aligned = numpy.frombuffer(buffers[i % queue_depth],
+                                                   dtype=numpy.uint8)
+                        aligned[:data.size] = data.reshape(-1)
+                        data = aligned[:data.size]
+                    in_flight.append(pool.submit(pwrite_all, fd, data,
+                                                 self.block_size * (self.offset + n)))
+                    stream.counter += count
+                for f in in_flight:
+                    f.result()
             if fsync:
                 os.fsync(fd)
+        finally:
+            os.close(fd)
         self.streams.append(stream)
 
 def make_block_range(path: str,
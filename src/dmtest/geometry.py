@@ -0,0 +1,113 @@
+import dmtest.command_trace as command_trace
+import fcntl
+import os
+import struct
+import threading
+
+# Block device geometry, cached by device number.  Tests ask for the size
+# of the same devices over and over, eg. every time a stack is built, so
+# we only query the kernel once.  dmdev.Dev drops the entry whenever it
+# changes a device's table, or removes it.
+
+# _IOR(0x12, 114, size_t), from linux/fs.h
+BLKGETSIZE64 = 0x80081272
+
+
+class Geometry:
+    """
+    The size comes from BLKGETSIZE64, like 'blockdev --getsz'.  The queue
+    limits, in bytes, are read from sysfs the first time they're asked
+    for; partitions share their disk's.
+    """
+
+    def __init__(self, rdev: int, size: int):
+        # in sectors
+        self.size = size
+        self._rdev = rdev
+        self._queue = {}
+
+    def _queue_param(self, param) -> int:
+        v = self._queue.get(param)
+        if v is None:
+            v = self._queue[param] = _queue_param(self._rdev, param)
+        return v
+
+    @property
+    def logical_block_size(self) -> int:
+        return self._queue_param("logical_block_size")
+
+    @property
+    def physical_block_size(self) -> int:
+        return self._queue_param("physical_block_size")
+
+    @property
+    def discard_granularity(self) -> int:
+        return self._queue_param("discard_granularity")
+
+    @property
+    def discard_max_bytes(self) -> int:
+        return self._queue_param("discard_max_bytes")
+
+    @property
+    def discard_supported(self) -> bool:
+        return self.discard_max_bytes > 0
+
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def _rdev(dev) -> int:
+    return os.stat(dev).st_rdev
+
+
+def _size_bytes(path) -> int:
+    with command_trace.timed("BLKGETSIZE64", path):
+        fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+        try:
+            buf = fcntl.ioctl(fd, BLKGETSIZE64, bytes(8))
+        finally:
+            os.close(fd)
+    return struct.unpack("=Q", buf)[0]
+
+
+def _queue_dir(rdev) -> str:
+    sys_dir = os.path.realpath(f"/sys/dev/block/{os.major(rdev)}:{os.minor(rdev)}")
+    if os.path.exists(os.path.join(sys_dir, "partition")):
+        # partitions have no queue of their own
+        sys_dir = os.path.dirname(sys_dir)
+    return os.path.join(sys_dir, "queue")
+
+
+def _queue_param(rdev, param) -> int:
+    with open(os.path.join(_queue_dir(rdev), param), "r") as f:
+        return int(f.read().strip())
+
+
+def geometry(dev) -> Geometry:
+    """
+    'dev' may be a path or a dmdev.Dev.
+    """
+    path = os.fspath(dev)
+    rdev = _rdev(path)
+    with _lock:
+        g = _cache.get(rdev)
+    if g is None:
+        g = Geometry(rdev, _size_bytes(path) // 512)
+        with _lock:
+            _cache[rdev] = g
+    return g
+
+
+def invalidate(dev):
+    try:
+        rdev = _rdev(dev)
+    except FileNotFoundError:
+        return
+    with _lock:
+        _cache.pop(rdev, None)
+
+
+def clear():
+    with _lock:
+        _cache.clear()
@@ -38,10 +38,6 @@ TAGS = [
 ]
 
 
-def drop_caches():
-    process.run("echo 3 > /proc/sys/vm/drop_caches")
-
-
 def prepare_(dev, fs_type, format_opts=None):
     if format_opts is None:
         format_opts = {}
@@ -76,8 +72,8 @@ def extract(dev, fs_type, tags=None):
             for tag in tags:
                 with utils.timed(f"checking out {tag}"):
                     repo.checkout(tag)
-                    process.run("sync")
-                    drop_caches()
+                    utils.sync()
+                    utils.drop_caches()
 
 
 def extract_each(dev, fs_type, callback, tags=None):
@@ -95,6 +91,6 @@ def extract_each(dev, fs_type, callback, tags=None):
 
                 with utils.timed(f"checking out {tag}"):
                     repo.checkout(tag)
-                    process.run("sync")
+                    utils.sync()
                     callback(index)
-                    # drop_caches()
+                    # utils.drop_caches()
@@ -0,0 +1,297 @@
+import logging as log
+import os
+import re
+import select
+import signal
+import threading
+import time
+
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, List, NamedTuple, Optional
+
+from dmtest.utils import get_dmesg_log
+
+# Number of kernel log records kept in memory.  Older records are dropped,
+# so a test that logs more than this loses the start of its kernel log.
+DEFAULT_CAPACITY = 100000
+
+# Kernel log lines that mean the kernel has gone wrong, and the test
+# should fail.
+OOPS_PATTERNS = re.compile(
+    "|".join(
+        [
+            r"BUG",
+            r"^WARNING:",
+            r"^Oops",
+            r"general protection fault",
+            r"Kernel panic",
+            r"blocked for more than \d+ seconds",
+            r"rcu_\w+ (detected|self-detected) stall",
+        ]
+    )
+)
+
+
+def is_oops(message: str) -> bool:
+    return bool(OOPS_PATTERNS.search(message))
+
+
+class KernelOops(BaseException):
+    """
+    Raised in the main thread when a kernel oops is seen while a test
+    is running.
+
+    Derived from BaseException, like KeyboardInterrupt, so tests that catch
+    Exception don't swallow it, but 'with' blocks still tear down.
+    """
+
+    pass
+
+
+class KmsgRecord(NamedTuple):
+    # position in the reader's stream, as returned by mark()
+    pos: int
+    seq: int
+    level: int
+    timestamp_us: int
+    message: str
+
+    def __str__(self):
+        return f"[{self.timestamp_us / 1000000:12.6f}] {self.message}"
+
+
+def parse_record(pos: int, data: bytes) -> Optional[KmsgRecord]:
+    """
+    Parses a single /dev/kmsg record:
+
+        <prefix>,<seq>,<timestamp>,<flags>[,...];<message>
+         KEY=value (continuation lines)
+
+    Returns None if the record is malformed.
+    """
+    txt = data.decode("utf-8", errors="replace")
+    header, sep, body = txt.partition(";")
+    if not sep:
+        return None
+
+    fields = header.split(",")
+    try:
+        prefix = int(fields[0])
+        seq = int(fields[1])
+        timestamp = int(fields[2])
+    except (IndexError, ValueError):
+        return None
+
+    message = body.split("\n", 1)[0]
+    return KmsgRecord(pos, seq, prefix & 7, timestamp, message)
+
+
+class KmsgReader:
+    """
+    Streams the kernel log from /dev/kmsg into a ring buffer, on a
+    background thread.
+
+    Callers take a mark() before a test, and ask for the records since the
+    mark afterwards, rather than re-reading the whole journal.  Oops
+    signatures are spotted as they arrive.
+    """
+
+    def __init__(self, path="/dev/kmsg", capacity=DEFAULT_CAPACITY):
+        self._fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+
+        # skip everything logged before we started
+        os.lseek(self._fd, 0, os.SEEK_END)
+
+        self._records = deque(maxlen=capacity)
+        self._nr_read = 0
+        self._last_seq = None
+        self._last_bug = -1
+        self._oops_callback: Optional[Callable[[KmsgRecord], None]] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _exc_type, _exc_value, _traceback):
+        self.stop()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        os.close(self._fd)
+
+    def _read_available(self):
+        # caller must hold the lock
+        while True:
+            try:
+                data = os.read(self._fd, 8192)
+            except BlockingIOError:
+                return
+            except BrokenPipeError:
+                # The kernel overwrote records before we read them.  The
+                # next read carries on from the oldest one still available.
+                log.warning("kernel log records lost, /dev/kmsg overrun")
+                continue
+
+            if not data:
+                return
+
+            r = parse_record(self._nr_read, data)
+            if r is None:
+                continue
+
+            if self._last_seq is not None and r.seq != self._last_seq + 1:
+                log.warning(f"kernel log records {self._last_seq + 1}-{r.seq - 1} lost")
+            self._last_seq = r.seq
+
+            if is_oops(r.message):
+                self._last_bug = r.pos
+                if self._oops_callback:
+                    self._oops_callback(r)
+
+            self._records.append(r)
+            self._nr_read += 1
+
+    def _run(self):
+        poller = select.poll()
+        poller.register(self._fd, select.POLLIN)
+        while not self._stop.is_set():
+            if poller.poll(100):
+                with self._lock:
+                    self._read_available()
+
+    def mark(self) -> int:
+        """
+        Returns a position in the log; everything logged after this call
+        is after the mark.
+        """
+        with self._lock:
+            self._read_available()
+            return self._nr_read
+
+    def records_since(self, mark: int) -> List[KmsgRecord]:
+        with self._lock:
+            self._read_available()
+
+            # walk back from the newest record, so the cost depends on the
+            # number of records since the mark, not the size of the buffer.
+            rs = []
+            for r in reversed(self._records):
+                if r.pos < mark:
+                    break
+                rs.append(r)
+            rs.reverse()
+            return rs
+
+    def text_since(self, mark: int) -> str:
+        return "".join(f"{r}\n" for r in self.records_since(mark))
+
+    def bug_since(self, mark: int) -> bool:
+        with self._lock:
+            self._read_available()
+            return self._last_bug >= mark
+
+    def _oops_since(self, mark: int) -> Optional[KmsgRecord]:
+        # caller must hold the lock
+        if self._last_bug < mark:
+            return None
+        for r in self._records:
+            if r.pos >= mark and is_oops(r.message):
+                return r
+        return None
+
+    @contextmanager
+    def abort_on_oops(self, mark: int):
+        """
+        Raises KernelOops in the main thread, interrupting any blocking
+        system call, as soon as an oops logged after 'mark' is read.  Only
+        raised once, so teardown isn't interrupted too.
+        """
+        main = threading.main_thread().ident
+        assert main is not None
+        armed = True
+        oops: Optional[KmsgRecord] = None
+
+        def handler(_signum, _frame):
+            nonlocal armed
+            if armed and oops is not None:
+                armed = False
+                raise KernelOops(f"kernel oops: {oops.message}")
+
+        def fire(record):
+            # called from whichever thread read the record, with the lock held
+            nonlocal oops
+            if oops is None:
+                oops = record
+                signal.pthread_kill(main, signal.SIGUSR1)
+
+        old_handler = signal.signal(signal.SIGUSR1, handler)
+        try:
+            with self._lock:
+                self._oops_callback = fire
+                r = self._oops_since(mark)
+                if r:
+                    fire(r)
+            yield
+        finally:
+            armed = False
+            with self._lock:
+                self._oops_callback = None
+            signal.signal(signal.SIGUSR1, old_handler)
+
+
+class JournalReader:
+    """
+    Fallback for when /dev/kmsg can't be read, with the same interface as
+    KmsgReader.  Queries journalctl for each slice.
+    """
+
+    def __init__(self):
+        # the last slice fetched, so bug_since() doesn't query again
+        self._last = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _exc_type, _exc_value, _traceback):
+        self.stop()
+
+    def stop(self):
+        pass
+
+    def mark(self) -> float:
+        return time.time()
+
+    def text_since(self, mark: float) -> str:
+        self._last = (mark, get_dmesg_log(mark))
+        return self._last[1]
+
+    def bug_since(self, mark: float) -> bool:
+        if self._last is None or self._last[0] != mark:
+            text = self.text_since(mark)
+        else:
+            text = self._last[1]
+        # journalctl prefixes each line with the date, host and 'kernel: '
+        lines = text.splitlines()
+        return any(is_oops(line.partition("kernel: ")[2] or line) for line in lines)
+
+    @contextmanager
+    def abort_on_oops(self, mark: float):
+        # journalctl can't be watched cheaply, so oopses are only noticed
+        # once the test has finished.
+        yield
+
+
+def kernel_log():
+    """
+    Returns a KmsgReader, or a JournalReader if /dev/kmsg isn't available.
+    """
+    try:
+        return KmsgReader()
+    except OSError as e:
+        log.warning(f"unable to read /dev/kmsg ({e}), falling back to journalctl")
+        return JournalReader()
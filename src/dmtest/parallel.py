@@ -0,0 +1,146 @@
+import dmtest.device_mapper.dev as dmdev
+import dmtest.tvm as tvm
+import dmtest.units as units
+
+import logging as log
+import multiprocessing
+import os
+import queue
+import random
+
+from contextlib import contextmanager, ExitStack
+from typing import Any, Callable, Dict, List, NamedTuple
+
+# Config entries naming devices that get carved up between the workers.
+# 'cache_dev' is optional, and only partitioned if present.
+partitioned_devs = ["metadata_dev", "data_dev", "cache_dev"]
+
+# Inputs that tests reference relative to the top level directory.  Each
+# worker runs in a private directory (so mount points such as ./mnt don't
+# collide), and these get symlinked into it.
+shared_inputs = ["compile-bench-datasets", "linux"]
+
+job_dir = "dmtest-jobs"
+
+
+class Task(NamedTuple):
+    path: str
+    run_nr: int
+
+
+def _partition_size(vm: tvm.VM, nr_jobs: int) -> int:
+    # keep each partition a whole number of megabytes, so pool and cache
+    # block sizes divide it evenly.
+    size = vm.free_space() // nr_jobs
+    return size - (size % units.meg(1))
+
+
+@contextmanager
+def partition_devices(cfg: Dict[str, Any], nr_jobs: int):
+    """
+    Carves the test devices named in the config into 'nr_jobs' disjoint
+    linear volumes, and yields a list of configs, one per worker, that
+    refer to those volumes instead of the whole devices.
+    """
+    cfgs = [dict(cfg) for _ in range(nr_jobs)]
+
+    with ExitStack() as stack:
+        for key in partitioned_devs:
+            if key not in cfg:
+                continue
+
+            vm = tvm.VM()
+            vm.add_allocation_volume(cfg[key])
+            size = _partition_size(vm, nr_jobs)
+            if size == 0:
+                raise ValueError(f"'{key}' is too small to split {nr_jobs} ways")
+
+            for job in range(nr_jobs):
+                name = f"{key}{job}"
+                vm.add_volume(tvm.LinearVolume(name, size))
+                dev = stack.enter_context(dmdev.dev(vm.table(name)))
+                log.info(f"job {job}: {key} = {dev.path}")
+                cfgs[job][key] = dev.path
+
+        yield cfgs
+
+
+def _job_dir(job: int) -> str:
+    return os.path.abspath(os.path.join(job_dir, f"job-{job}"))
+
+
+def _prepare_job_dir(job: int) -> str:
+    path = _job_dir(job)
+    os.makedirs(path, exist_ok=True)
+
+    for name in shared_inputs:
+        src = os.path.abspath(name)
+        dest = os.path.join(path, name)
+        if os.path.exists(src) and not os.path.lexists(dest):
+            os.symlink(src, dest)
+
+    return path
+
+
+def _worker(job, cfg, run_fn, tasks, results):
+    # Every worker is forked from the same parent, so they'd all generate
+    # the same 'random' device names unless reseeded.
+    random.seed()
+    os.chdir(_prepare_job_dir(job))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        results.put(run_fn(task, cfg))
+
+
+def run_parallel(
+    tasks: List[Task],
+    cfgs: List[Dict[str, Any]],
+    run_fn: Callable[[Task, Dict[str, Any]], Any],
+    on_result: Callable[[Any], None],
+):
+    """
+    Runs the tasks across one worker process per config.  Workers pull
+    tasks as they become free, so long tests don't hold up short ones.
+
+    'run_fn' is called in the worker with the task and the worker's config,
+    and must return something picklable.  'on_result' is called in this
+    process as each result arrives.
+    """
+    # Fork, rather than spawn, so the workers inherit the test register
+    # and logging set up.
+    ctx = multiprocessing.get_context("fork")
+    task_q = ctx.Queue()
+    result_q = ctx.Queue()
+
+    for t in tasks:
+        task_q.put(t)
+    for _ in cfgs:
+        task_q.put(None)
+
+    workers = []
+    for job, cfg in enumerate(cfgs):
+        w = ctx.Process(target=_worker, args=(job, cfg, run_fn, task_q, result_q))
+        w.start()
+        workers.append(w)
+
+    try:
+        pending = len(tasks)
+        while pending:
+            try:
+                r = result_q.get(timeout=1.0)
+            except queue.Empty:
+                if not any(w.is_alive() for w in workers):
+                    raise RuntimeError(f"all workers exited with {pending} tests outstanding")
+                continue
+            on_result(r)
+            pending -= 1
+    except BaseException:
+        for w in workers:
+            w.terminate()
+        raise
+    finally:
+        for w in workers:
+            w.join()
@@ -69,8 +69,7 @@ def thins(pool, size, *ids):
 
 
 def new_thins(pool, size, ids):
-    for id in ids:
-        pool.message(0, f"create_thin {id}")
+    pool.messages(0, [f"create_thin {id}" for id in ids])
 
     return thins(pool, size, *ids)
 
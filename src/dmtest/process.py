@@ -1,10 +1,174 @@
 import logging as log
 import os
+import signal
 import subprocess
+import threading
+import time
+import dmtest.command_trace as command_trace
+import dmtest.db as db
 import dmtest.dependency_tracker as dep
 
 
-def run(command, raise_on_fail=True):
+# Seconds a command may run for before it's killed, unless the caller
+# passes its own timeout.  None means no limit.  Set from the config, or
+# the command line, by 'dmtest run'.
+DEFAULT_TIMEOUT = 2 * 60 * 60
+default_timeout = DEFAULT_TIMEOUT
+
+# Seconds between SIGTERM and SIGKILL when killing a command.
+KILL_GRACE = 5
+
+
+class CommandTimeout(BaseException):
+    """
+    Raised when a command runs for longer than its timeout.
+
+    Derived from BaseException, like kmsg.KernelOops, so tests that expect
+    a command to fail, and catch Exception, don't pass because it hung.
+    """
+
+    def __init__(self, command, timeout, stdout="", stderr=""):
+        super().__init__(f"'{command}' timed out after {timeout}s")
+        self.command = command
+        self.timeout = timeout
+        self.stdout = stdout
+        self.stderr = stderr
+
+
+def set_default_timeout(seconds):
+    global default_timeout
+    default_timeout = seconds
+
+
+class _Command:
+    """
+    A running shell command, in its own process group so everything it
+    starts can be killed.  The child is reaped here with wait4(), rather
+    than by subprocess, so we get its resource usage, including that of
+    any children it waited for.
+    """
+
+    def __init__(self, command, env, input):
+        self.proc = subprocess.Popen(
+            command,
+            env=env,
+            shell=True,
+            stdin=subprocess.PIPE if input is not None else None,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            start_new_session=True,
+        )
+        self.rusage = None
+        self.timed_out = False
+        self._reaped = threading.Event()
+        self._output = {}
+        self._readers = [
+            threading.Thread(target=self._drain, args=(name, f), daemon=True)
+            for name, f in (("stdout", self.proc.stdout), ("stderr", self.proc.stderr))
+        ]
+        for t in self._readers:
+            t.start()
+
+        if input is not None:
+            stdin = self.proc.stdin
+            assert stdin is not None
+            try:
+                stdin.write(input)
+                stdin.close()
+            except BrokenPipeError:
+                # the command didn't want it all
+                pass
+
+    def _drain(self, name, f):
+        self._output[name] = f.read()
+        f.close()
+
+    def kill(self):
+        """
+        Kills the command and everything it started; the shell's children
+        would otherwise hold the pipes open, or the device, after it's gone.
+        """
+        for sig in (signal.SIGTERM, signal.SIGKILL):
+            try:
+                os.killpg(self.proc.pid, sig)
+            except ProcessLookupError:
+                return
+            if self._finished(KILL_GRACE):
+                return
+
+    def _finished(self, timeout):
+        deadline = time.monotonic() + timeout
+        if not self._reaped.wait(timeout):
+            return False
+        for t in self._readers:
+            t.join(max(0.0, deadline - time.monotonic()))
+        return not any(t.is_alive() for t in self._readers)
+
+    def _expire(self):
+        self.timed_out = True
+        self.kill()
+
+    def wait(self, timeout):
+        """
+        Reaps the command, and waits for its output, killing it if that
+        takes longer than 'timeout' seconds.  Returns (stdout, stderr).
+        """
+        timer = None
+        if timeout:
+            timer = threading.Timer(timeout, self._expire)
+            timer.daemon = True
+            timer.start()
+        try:
+            (_, status, self.rusage) = os.wait4(self.proc.pid, 0)
+            self._reap(status)
+            # processes left behind in the group may still hold the pipes
+            return self._collect()
+        finally:
+            if timer:
+                timer.cancel()
+
+    def abort(self):
+        # eg. the test has been aborted, don't leave the tool running
+        threading.Thread(target=self.kill, daemon=True).start()
+        if self.proc.returncode is None:
+            (_, status, self.rusage) = os.wait4(self.proc.pid, 0)
+            self._reap(status)
+        self._collect()
+
+    def _reap(self, status):
+        # so subprocess doesn't try to reap it again
+        self.proc.returncode = os.waitstatus_to_exitcode(status)
+        self._reaped.set()
+
+    def _collect(self):
+        for t in self._readers:
+            t.join()
+        return (self._output.get("stdout", ""), self._output.get("stderr", ""))
+
+
+def _record(exe, command, start, cmd):
+    ru = cmd.rusage
+    command_trace.add_record(
+        db.CommandRecord(
+            exe,
+            command,
+            time.monotonic() - start,
+            ru.ru_utime if ru else 0.0,
+            ru.ru_stime if ru else 0.0,
+            ru.ru_maxrss if ru else 0,
+            cmd.proc.returncode,
+        )
+    )
+
+
+def run(command, raise_on_fail=True, input=None, timeout=None):
+    """
+    Runs a shell command, returning (return code, stdout, stderr).  The
+    command, and any processes it starts, are killed if it runs for more
+    than 'timeout' seconds (process.default_timeout if None), and
+    CommandTimeout is raised.
+    """
     log.info(f"running: '{command}'")
 
     # Register the exe with the dependency tracker
@@ -16,15 +180,28 @@ def run(command, raise_on_fail=True):
     bt_env = os.environ.copy()
     bt_env["RUST_BACKTRACE"] = "full"
 
-    proc = subprocess.Popen(
-        command,
-        env=bt_env,
-        shell=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        universal_newlines=True,
-    )
-    stdout, stderr = proc.communicate()
+    if timeout is None:
+        timeout = default_timeout
+
+    start = time.monotonic()
+    cmd = _Command(command, bt_env, input)
+    try:
+        stdout, stderr = cmd.wait(timeout)
+    except BaseException:
+        cmd.abort()
+        _record(exe, command, start, cmd)
+        raise
+    _record(exe, command, start, cmd)
+    proc = cmd.proc
+
+    if cmd.timed_out:
+        log.error(f"'{command}' timed out after {timeout}s, killed it")
+        if stdout:
+            log.info(f"stdout:\n{stdout.rstrip()}")
+        if stderr:
+            log.info(f"stderr:\n{stderr.rstrip()}")
+        raise CommandTimeout(command, timeout, stdout, stderr)
+
     if stdout:
         log.info(f"stdout:\n{stdout.rstrip()}")
     if stderr:
@@ -0,0 +1,124 @@
+import math
+
+from functools import lru_cache
+from typing import NamedTuple, Sequence
+
+# Samples at most this size, without ties, get an exact p-value.  Larger
+# ones use the normal approximation.
+EXACT_LIMIT = 20
+
+
+@lru_cache(maxsize=None)
+def _u_count(n1: int, n2: int, u: int) -> int:
+    """
+    The number of orderings of n1 + n2 distinct values for which the
+    Mann-Whitney U statistic of the first sample equals 'u'.
+    """
+    if u < 0 or u > n1 * n2:
+        return 0
+    if n1 == 0 or n2 == 0:
+        return 1 if u == 0 else 0
+    return _u_count(n1 - 1, n2, u - n2) + _u_count(n1, n2 - 1, u)
+
+
+def _u_statistic(xs: Sequence[float], ys: Sequence[float]) -> float:
+    u = 0.0
+    for x in xs:
+        for y in ys:
+            if x > y:
+                u += 1.0
+            elif x == y:
+                u += 0.5
+    return u
+
+
+def _exact_p(u: float, n1: int, n2: int) -> float:
+    total = math.comb(n1 + n2, n1)
+    u_lo = math.floor(u)
+    u_hi = math.ceil(u)
+    below = sum(_u_count(n1, n2, k) for k in range(0, u_lo + 1)) / total
+    above = sum(_u_count(n1, n2, k) for k in range(u_hi, n1 * n2 + 1)) / total
+    return min(1.0, 2 * min(below, above))
+
+
+def _normal_p(u: float, xs: Sequence[float], ys: Sequence[float]) -> float:
+    n1 = len(xs)
+    n2 = len(ys)
+    n = n1 + n2
+
+    counts = {}
+    for v in list(xs) + list(ys):
+        counts[v] = counts.get(v, 0) + 1
+    ties = sum(t * t * t - t for t in counts.values())
+
+    mu = n1 * n2 / 2
+    var = n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1)))
+    if var <= 0:
+        # every value is the same
+        return 1.0
+
+    # continuity correction
+    z = max(abs(u - mu) - 0.5, 0.0) / math.sqrt(var)
+    return math.erfc(z / math.sqrt(2))
+
+
+def mann_whitney(xs: Sequence[float], ys: Sequence[float]) -> float:
+    """
+    Two-sided p-value for the Mann-Whitney U test, ie. the probability of
+    seeing samples this different if both came from the same distribution.
+    """
+    if not xs or not ys:
+        raise ValueError("mann_whitney needs two non-empty samples")
+
+    u = _u_statistic(xs, ys)
+    no_ties = len(set(xs) | set(ys)) == len(xs) + len(ys)
+    if no_ties and len(xs) <= EXACT_LIMIT and len(ys) <= EXACT_LIMIT:
+        return _exact_p(u, len(xs), len(ys))
+    return _normal_p(u, xs, ys)
+
+
+def median(values: Sequence[float]) -> float:
+    ordered = sorted(values)
+    mid = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[mid]
+    return (ordered[mid - 1] + ordered[mid]) / 2
+
+
+class Comparison(NamedTuple):
+    old: float
+    new: float
+    p_value: float
+    significant: bool
+
+    @property
+    def diff(self) -> float:
+        return self.new - self.old
+
+    @property
+    def percent(self) -> float:
+        return self.diff * 100 / self.old if self.old else 0.0
+
+
+def compare(old: Sequence[float], new: Sequence[float], alpha: float) -> Comparison:
+    """
+    Compares the medians of two sets of runs.  The difference is only
+    flagged as significant if the Mann-Whitney test rejects the two
+    coming from the same distribution at level 'alpha'.  Single runs
+    can't be tested, so are never significant.
+    """
+    if len(old) < 2 or len(new) < 2:
+        p = 1.0
+    else:
+        p = mann_whitney(old, new)
+
+    return Comparison(median(old), median(new), p, p < alpha)
+
+
+def higher_is_better(unit: str) -> bool:
+    """
+    Guesses the direction of a metric from its unit: rates, such as
+    'MiB/s' or 'iops', are better when higher, everything else, eg.
+    latencies, when lower.
+    """
+    return unit.endswith("/s") or unit == "iops"
@@ -0,0 +1,234 @@
+import dmtest.db as db
+import dmtest.vdo.stats as vdo_stats
+import logging as log
+import os
+import threading
+import time
+
+from array import array
+from typing import Callable, Dict, List, Mapping, Optional
+
+# Seconds between samples.
+DEFAULT_INTERVAL = 0.5
+
+# The /proc/diskstats fields we keep, by position after the device name.
+DISKSTATS_FIELDS = {
+    0: "reads",
+    2: "read_sectors",
+    4: "writes",
+    6: "write_sectors",
+    8: "in_flight",
+    9: "io_ticks_ms",
+    11: "discards",
+    13: "discard_sectors",
+}
+
+BUFIO_PARAMS = [
+    "current_allocated_bytes",
+    "peak_allocated_bytes",
+    "max_cache_size_bytes",
+]
+
+Probe = Callable[[], Mapping[str, float]]
+
+
+class _Series:
+    def __init__(self, name: str, unit: str):
+        self.name = name
+        self.unit = unit
+        self.times = array("d")
+        self.values = array("d")
+
+    def append(self, t: float, value: float):
+        self.times.append(t)
+        self.values.append(value)
+
+    def freeze(self) -> db.Series:
+        return db.Series(self.name, self.unit, self.times, self.values)
+
+
+class _QuietThread(log.Filter):
+    # The probes log every status call they make, which would swamp the
+    # test log.
+    def __init__(self, thread_name):
+        super().__init__()
+        self._thread_name = thread_name
+
+    def filter(self, record):
+        return record.threadName != self._thread_name or record.levelno >= log.WARNING
+
+
+class Sampler:
+    """
+    Samples numeric values, eg. pool usage or disk stats, on a background
+    thread while a test runs, building a time series for each.
+
+    Probes can be added before or after the sampler is started.  Each
+    probe returns a dict of named values; a probe that raises is logged
+    and dropped.
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL):
+        self._interval = interval
+        self._probes = []
+        self._series: Dict[str, _Series] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._filter = None
+        self._start: Optional[float] = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, _exc_type, _exc_value, _traceback):
+        self.stop()
+
+    def add_probe(self, prefix: str, probe: Probe, unit: str = ""):
+        with self._lock:
+            self._probes.append((prefix, probe, unit))
+
+    def add_status(self, dev, name=None):
+        """
+        Samples the numeric fields of each target's status, eg. a thin
+        pool's data_used.
+        """
+        self.add_probe(name or dev.name, lambda: status_values(dev))
+
+    def add_diskstats(self, dev, name=None):
+        self.add_probe(f"{name or _dev_name(dev)}.diskstats", diskstats_probe(dev))
+
+    def add_vdo_stats(self, dev, name=None):
+        self.add_probe(f"{name or dev.name}.stats", lambda: vdo_stats_values(dev))
+
+    def add_bufio(self):
+        self.add_probe("bufio", bufio_values, unit="bytes")
+
+    def start(self):
+        self._start = time.monotonic()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._filter = _QuietThread(self._thread.name)
+        log.getLogger().addFilter(self._filter)
+        self._thread.start()
+
+    def stop(self):
+        # start() may have failed part way through
+        self._stop.set()
+        if self._thread is not None and self._thread.ident is not None:
+            self._thread.join()
+        if self._filter is not None:
+            log.getLogger().removeFilter(self._filter)
+            self._filter = None
+
+        for s in self._series.values():
+            if s.values:
+                summary = (
+                    f"series {s.name}: {len(s.values)} samples, "
+                    f"min {min(s.values):g}, max {max(s.values):g}, "
+                    f"last {s.values[-1]:g} {s.unit}"
+                )
+                log.info(summary.rstrip())
+
+    def _run(self):
+        while True:
+            self.sample()
+            if self._stop.wait(self._interval):
+                break
+
+        # and one last sample, so the series covers the whole run
+        self.sample()
+
+    def sample(self):
+        with self._lock:
+            probes = list(self._probes)
+
+        assert self._start is not None, "sampler not started"
+        t = time.monotonic() - self._start
+        for p in probes:
+            prefix, probe, unit = p
+            try:
+                values = probe()
+            except Exception as e:
+                log.warning(f"dropping sampler probe '{prefix}': {e}")
+                with self._lock:
+                    if p in self._probes:
+                        self._probes.remove(p)
+                continue
+
+            with self._lock:
+                for k, v in values.items():
+                    name = f"{prefix}.{k}"
+                    s = self._series.get(name)
+                    if s is None:
+                        s = self._series[name] = _Series(name, unit)
+                    s.append(t, float(v))
+
+    @property
+    def series(self) -> List[db.Series]:
+        with self._lock:
+            return [s.freeze() for s in self._series.values()]
+
+
+def _numeric(v) -> bool:
+    return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+
+def status_values(dev) -> Dict[str, float]:
+    # noflush, so a thin-pool doesn't commit its metadata for every sample
+    statuses = dev.parsed_status(noflush=True)
+    values = {}
+    for i, s in enumerate(statuses):
+        prefix = f"{i}." if len(statuses) > 1 else ""
+        for field in s.__slots__:
+            v = getattr(s, field)
+            if _numeric(v):
+                values[f"{prefix}{field}"] = v
+    return values
+
+
+def _flatten(d, prefix, out):
+    for k, v in d.items():
+        if isinstance(v, dict):
+            _flatten(v, f"{prefix}{k}.", out)
+        elif _numeric(v):
+            out[f"{prefix}{k}"] = v
+
+
+def vdo_stats_values(dev) -> Dict[str, float]:
+    values = {}
+    # no sync, it would perturb the test being watched
+    _flatten(vdo_stats.vdo_stats(dev, sync=False), "", values)
+    return values
+
+
+def _dev_name(dev) -> str:
+    return getattr(dev, "name", None) or os.path.basename(os.fspath(dev))
+
+
+def diskstats_probe(dev) -> Probe:
+    rdev = os.stat(dev).st_rdev
+    key = (str(os.major(rdev)), str(os.minor(rdev)))
+
+    def probe():
+        with open("/proc/diskstats") as f:
+            for line in f:
+                fields = line.split()
+                if (fields[0], fields[1]) == key:
+                    stats = fields[3:]
+                    return {
+                        name: int(stats[i])
+                        for i, name in DISKSTATS_FIELDS.items()
+                        if i < len(stats)
+                    }
+        raise ValueError(f"{dev} not in /proc/diskstats")
+
+    return probe
+
+
+def bufio_values() -> Dict[str, float]:
+    values = {}
+    for p in BUFIO_PARAMS:
+        with open(f"/sys/module/dm_bufio/parameters/{p}") as f:
+            values[p] = int(f.read())
+    return values
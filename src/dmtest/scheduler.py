@@ -0,0 +1,67 @@
+import heapq
+import math
+
+from typing import AbstractSet, Dict, Iterable, List, Sequence
+
+# Durations are estimated with a high percentile rather than the mean, so a
+# test that is occasionally slow still gets started early.
+DEFAULT_PERCENTILE = 90
+
+
+def percentile(values: Sequence[float], pct: float) -> float:
+    """
+    Nearest-rank percentile of a non-empty sequence.
+    """
+    ordered = sorted(values)
+    rank = math.ceil(pct / 100 * len(ordered))
+    return ordered[max(rank, 1) - 1]
+
+
+def estimate_durations(
+    history: Dict[str, List[float]],
+    paths: Iterable[str],
+    pct: float = DEFAULT_PERCENTILE,
+) -> Dict[str, float]:
+    """
+    Estimates how long each test will take from its previous durations.
+    Tests that have never completed are given the mean of the estimates for
+    the tests that have.
+    """
+    paths = list(paths)
+    estimates = {p: percentile(history[p], pct) for p in paths if history.get(p)}
+
+    if estimates:
+        default = sum(estimates.values()) / len(estimates)
+    else:
+        default = 0.0
+
+    for p in paths:
+        estimates.setdefault(p, default)
+
+    return estimates
+
+
+def order_paths(
+    paths: Sequence[str],
+    estimates: Dict[str, float],
+    failed: AbstractSet[str] = frozenset(),
+) -> List[str]:
+    """
+    Longest-processing-time-first ordering.  When workers take the next test
+    as they become free, this gives the greedy LPT schedule.  Tests in
+    'failed' go ahead of everything else, so regressions show up early.
+    """
+    return sorted(paths, key=lambda p: (p not in failed, -estimates.get(p, 0.0)))
+
+
+def predicted_makespan(
+    durations: Iterable[float], nr_workers: int
+) -> float:
+    """
+    Simulates handing out the durations, in order, to whichever worker is
+    free first.  Returns the time at which the last worker finishes.
+    """
+    workers = [0.0] * nr_workers
+    for d in durations:
+        heapq.heappush(workers, heapq.heappop(workers) + d)
+    return max(workers)
@@ -56,11 +56,15 @@ class TestRegister:
                 path, callback, dep_fn = test
             self.register(prefix + path.lstrip("/"), callback, dep_fn)
 
-    def paths(self, results, result_set, filt=None):
+    def paths(self, results, result_set, filt=None, summaries=None):
+        # callers that need the summaries themselves can pass them in, so
+        # the query only runs once
         selected = []
+        if summaries is None:
+            summaries = results.get_result_set_summaries(result_set)
 
         for t in self._tests.keys():
-            res_list = results.get_test_results(t, result_set)
+            res_list = summaries.get(t, [])
             if filt.matches(t, res_list):
                 selected.append(t)
 
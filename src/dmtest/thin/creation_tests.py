@@ -9,22 +9,23 @@ import dmtest.utils as utils
 
 def t_create_lots_of_empty_thins(fix):
     with standard_pool(fix) as pool:
-        for id in range(1000):
-            pool.message(0, f"create_thin {id}")
+        pool.messages(0, [f"create_thin {id}" for id in range(1000)])
 
 
 def t_create_lots_of_empty_snaps(fix):
     with standard_pool(fix) as pool:
         pool.message(0, "create_thin 0")
-        for id in range(1, 1000):
-            pool.message(0, f"create_snap {id} 0")
+        pool.messages(0, [f"create_snap {id} 0" for id in range(1, 1000)])
 
 
 def t_create_lots_of_recursive_snaps(fix):
     with standard_pool(fix) as pool:
         pool.message(0, "create_thin 0")
-        for id in range(1, 1000):
-            pool.message(0, f"create_snap {id} {id - 1}")
+        pool.messages(
+            0,
+            [f"create_snap {id} {id - 1}" for id in range(1, 1000)],
+            stop_on_error=True,
+        )
 
 
 def t_activate_thin_while_pool_suspended_fails(fix):
@@ -11,28 +11,26 @@ import re
 
 def t_create_delete_cycle(fix):
     with standard_pool(fix) as pool:
+        msgs = []
         for id in range(1000):
-            pool.message(0, "create_thin 0")
-            pool.message(0, "delete 0")
+            msgs += ["create_thin 0", "delete 0"]
+        pool.messages(0, msgs, stop_on_error=True)
 
 
 def t_create_many_delete_many(fix):
     with standard_pool(fix) as pool:
-        for id in range(1000):
-            pool.message(0, f"create_thin {id}")
-
-        for id in range(1000):
-            pool.message(0, f"delete {id}")
+        pool.messages(0, [f"create_thin {id}" for id in range(1000)])
+        pool.messages(0, [f"delete {id}" for id in range(1000)])
 
 
 def t_create_delete_rolling(fix):
     with standard_pool(fix) as pool:
-        for id in range(1000):
-            pool.message(0, f"create_thin {id}")
+        pool.messages(0, [f"create_thin {id}" for id in range(1000)])
 
+        msgs = []
         for id in range(1000):
-            pool.message(0, f"delete {id}")
-            pool.message(0, f"create_thin {id}")
+            msgs += [f"delete {id}", f"create_thin {id}"]
+        pool.messages(0, msgs, stop_on_error=True)
 
 
 def t_delete_provisioned_thin(fix):
@@ -44,12 +42,12 @@ def t_delete_provisioned_thin(fix):
             utils.wipe_device(thin)
 
         s = status.pool_status(pool)
-        assert (s["data-used"] * block_size) == thin_size
+        assert (s.data_used * block_size) == thin_size
 
         pool.message(0, "delete 0")
 
         s = status.pool_status(pool)
-        assert s["data-used"] == 0
+        assert s.data_used == 0
 
 
 def t_delete_unknown_id_fails(fix):
@@ -80,13 +78,13 @@ def t_delete_after_out_of_space(fix):
                 pass
 
         s = status.pool_status(pool)
-        assert s["mode"] == "out-of-data-space"
+        assert s.mode == "out-of-data-space"
 
         pool.message(0, "delete 0")
 
         s = status.pool_status(pool)
-        assert s["mode"] == "read-write"
-        assert s["data-used"] == 0
+        assert s.mode == "read-write"
+        assert s.data_used == 0
 
 
 def register(tests):
@@ -1,6 +1,7 @@
 from dmtest.thin.utils import standard_stack, standard_pool
 import dmtest.blktrace as bt
 import dmtest.device_mapper.dev as dmdev
+import dmtest.geometry as geometry
 import dmtest.pool_stack as ps
 import dmtest.process as process
 import dmtest.tvm as tvm
@@ -13,19 +14,13 @@ import xml.etree.ElementTree as ET
 import xml.dom.minidom
 
 
-def read_param(dev, param):
-    with open(f"/sys/block/{dev}/queue/discard_{param}", "r") as file:
-        line = file.readline()
-
-    return int(line.strip())
-
-
 class DiscardLimits:
     def __init__(self, dev):
+        g = geometry.geometry(dev)
         self.dev = Path(dev).resolve().name
-        self.granularity = read_param(self.dev, "granularity")
-        self.max_bytes = read_param(self.dev, "max_bytes")
-        self.supported = self.max_bytes > 0
+        self.granularity = g.discard_granularity
+        self.max_bytes = g.discard_max_bytes
+        self.supported = g.discard_supported
 
 
 def ensure_discardable(dev):
@@ -14,10 +14,10 @@ import dmtest.pattern_stomper as stomper
 import dmtest.test_register as reg
 import dmtest.tvm as tvm
 
+import json
 import os
 import threading
 import logging as log
-import time
 
 #---------------------------------
 
@@ -41,7 +41,30 @@ stonewall
 timeout=30
 """
 
-def run_fio(dev, fs_type, fio_config, out_file):
+def record_fio_metrics(fix, out_file):
+    """
+    Sums bandwidth and iops across all the fio jobs, and records them
+    as metrics.  The output file holds fio's normal report followed by
+    the json one; only the latter is parsed.
+    """
+    with open(out_file, "r") as f:
+        text = f.read()
+
+    start = text.find("\n{\n")
+    if text.startswith("{\n"):
+        start = 0
+    elif start < 0:
+        raise ValueError(f"no json report in {out_file}")
+    fio_out, _ = json.JSONDecoder().raw_decode(text[start:].lstrip())
+
+    for op in ["read", "write"]:
+        bw = sum(job[op]["bw"] for job in fio_out["jobs"])
+        iops = sum(job[op]["iops"] for job in fio_out["jobs"])
+        fix.record_metric(f"{op}_bw", bw / 1024, "MiB/s")
+        fix.record_metric(f"{op}_iops", iops, "iops")
+
+
+def run_fio(fix, dev, fs_type, fio_config, out_file):
     # convert out_file to be absolute since we're about to chdir
     out_file = os.path.abspath(out_file)
 
@@ -51,7 +74,9 @@ def run_fio(dev, fs_type, fio_config, out_file):
     with fs.mount_and_chdir("./mnt", discard=False):
         with open("fio.config", "w") as f:
             f.write(fio_config)
-        process.run(f"fio fio.config --output={out_file}")
+        process.run(f"fio fio.config --output={out_file} --output-format=normal,json")
+
+    record_fio_metrics(fix, out_file)
 
 def t_fio_thick(fix):
     size = units.gig(90)
@@ -61,19 +86,16 @@ def t_fio_thick(fix):
     vm.add_volume(tvm.LinearVolume("thick", size))
 
     with dmdev.dev(vm.table("thick")) as thick:
-        time.sleep(1)
-
         outfile = "fio.out"
-        run_fio(thick, fs.Ext4, fio_config, outfile)        
+        run_fio(fix, thick, fs.Ext4, fio_config, outfile)
 
 def t_fio_thin(fix):
     size = units.gig(90)
 
     with standard_pool(fix) as pool:
         with ps.new_thin(pool, size, 0) as thin:
-            time.sleep(1)
             outfile = "fio.out"
-            run_fio(thin, fs.Ext4, fio_config, outfile)
+            run_fio(fix, thin, fs.Ext4, fio_config, outfile)
 
 def t_fio_thin_preallocated(fix):
     size = units.gig(90)
@@ -82,7 +104,7 @@ def t_fio_thin_preallocated(fix):
         with ps.new_thin(pool, size, 0) as thin:
             utils.wipe_device(thin)
             outfile = "fio.out"
-            run_fio(thin, fs.Ext4, fio_config, outfile)
+            run_fio(fix, thin, fs.Ext4, fio_config, outfile)
 
 def register(tests):
     tests.register_batch(
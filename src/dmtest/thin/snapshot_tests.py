@@ -92,7 +92,7 @@ def run_break_sharing(fix, fs_type):
             with thin_fs.mount_and_chdir(dir):
                 ds1.apply(1000)
 
-            data_used = status.pool_status(pool)["data-used"]
+            data_used = status.pool_status(pool).data_used
             print(f"data used: {data_used}, expected: {blocks_per_dev}")
 
             with ps.new_snap(pool, thin_size, 1, 0) as snap:
@@ -100,7 +100,7 @@ def run_break_sharing(fix, fs_type):
                 with thin_fs2.mount_and_chdir(dir):
                     ds2.apply(1000)
 
-            data_used = status.pool_status(pool)["data-used"]
+            data_used = status.pool_status(pool).data_used
             print(f"data used: {data_used}, expected: {blocks_per_dev * 2}")
 
 
@@ -124,13 +124,13 @@ def t_space_use(fix):
         with ps.new_thin(pool, thin_size, 0) as thin:
             utils.wipe_device(thin)
 
-        data_used = status.pool_status(pool)["data-used"]
+        data_used = status.pool_status(pool).data_used
         assert_equal(data_used, blocks_per_dev)
 
         with ps.new_snap(pool, thin_size, 1, 0) as snap:
             utils.wipe_device(snap)
 
-        data_used = status.pool_status(pool)["data-used"]
+        data_used = status.pool_status(pool).data_used
         assert_equal(data_used, 2 * blocks_per_dev)
 
 
@@ -145,8 +145,7 @@ def t_many_snapshots_of_same_volume(fix):
             utils.dt_device(thin)
 
             with thin.pause():
-                for id in range(1, 1000):
-                    pool.message(0, f"create_snap {id} 0")
+                pool.messages(0, [f"create_snap {id} 0" for id in range(1, 1000)])
 
             utils.dt_device(thin)
 
@@ -160,8 +159,7 @@ def t_parallel_io_to_shared_thins(fix):
         with ps.new_thin(pool, thin_size, 0) as thin:
             utils.wipe_device(thin)
 
-        for id in range(1, 6):
-            pool.message(0, f"create_snap {id} 0")
+        pool.messages(0, [f"create_snap {id} 0" for id in range(1, 6)])
 
         # Define the function to be run in each thread
         def run_dt(id):
@@ -189,8 +187,7 @@ def t_ref_count_tree(fix):
         with ps.new_thin(pool, volume_size, 0) as thin:
             utils.wipe_device(thin)
 
-        for id in range(1, 6):
-            pool.message(0, f"create_snap {id} 0")
+        pool.messages(0, [f"create_snap {id} 0" for id in range(1, 6)])
 
         with ps.thins(pool, volume_size, *[0, 1, 2, 3, 4, 5]) as thins:
             for thin in thins:
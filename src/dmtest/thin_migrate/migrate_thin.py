@@ -60,10 +60,10 @@ def t_migrate_thin_to_thin(fix):
 
                     dest_status = status.thin_status(dest_thin)
                     src_status = status.thin_status(src_thin)
-                    assert_equal(dest_status['mapped-sectors'],
-                                 src_status['mapped-sectors'])
-                    assert_equal(dest_status['highest-mapped-sector'],
-                                 src_status['highest-mapped-sector'])
+                    assert_equal(dest_status.mapped_sectors,
+                                 src_status.mapped_sectors)
+                    assert_equal(dest_status.highest_mapped_sector,
+                                 src_status.highest_mapped_sector)
 
                     src_pool.message(0, f"release_metadata_snap")
 
@@ -112,10 +112,10 @@ def t_large_block_size(fix):
 
                     dest_status = status.thin_status(dest_thin)
                     src_status = status.thin_status(src_thin)
-                    assert_equal(dest_status['mapped-sectors'],
-                                 src_status['mapped-sectors'])
-                    assert_equal(dest_status['highest-mapped-sector'],
-                                 src_status['highest-mapped-sector'])
+                    assert_equal(dest_status.mapped_sectors,
+                                 src_status.mapped_sectors)
+                    assert_equal(dest_status.highest_mapped_sector,
+                                 src_status.highest_mapped_sector)
 
                     src_pool.message(0, f"release_metadata_snap")
 
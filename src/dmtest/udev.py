@@ -0,0 +1,129 @@
+import logging as log
+import os
+import select
+import socket
+import struct
+import time
+
+from typing import Dict, Optional
+
+NETLINK_KOBJECT_UEVENT = 15
+
+# udevd rebroadcasts each uevent on this netlink group once it has
+# finished processing it, ie. once the nodes and symlinks exist and any
+# probing by the rules is done.
+UDEV_GROUP = 2
+UDEV_MAGIC = 0xFEEDCAFE
+
+DEFAULT_TIMEOUT = 30.0
+
+
+def running() -> bool:
+    return os.path.exists("/run/udev/control")
+
+
+def _seqnum() -> int:
+    with open("/sys/kernel/uevent_seqnum") as f:
+        return int(f.read())
+
+
+def parse_event(data: bytes) -> Optional[Dict[str, str]]:
+    """
+    Parses the properties from a libudev monitor message:
+
+        "libudev\\0", magic (big endian), header_size, properties_off,
+        properties_len, ... then NUL separated KEY=value pairs.
+
+    Returns None for anything else.
+    """
+    if not data.startswith(b"libudev\0") or len(data) < 24:
+        return None
+    (magic,) = struct.unpack_from(">I", data, 8)
+    if magic != UDEV_MAGIC:
+        return None
+    _, off, length = struct.unpack_from("=III", data, 12)
+
+    props = {}
+    for field in data[off : off + length].split(b"\0"):
+        k, sep, v = field.decode(errors="replace").partition("=")
+        if sep:
+            props[k] = v
+    return props
+
+
+class UeventMonitor:
+    """
+    Waits for udev to finish processing the uevents for a device, rather
+    than sleeping and hoping.
+
+    Open the monitor before the operation that triggers the uevent, so it
+    can't be missed.  If udevd isn't running there's nothing to wait for,
+    and every wait succeeds immediately.
+    """
+
+    def __init__(self):
+        self._sock = None
+        if not running():
+            return
+
+        self._sock = socket.socket(
+            socket.AF_NETLINK,
+            socket.SOCK_DGRAM | socket.SOCK_CLOEXEC,
+            NETLINK_KOBJECT_UEVENT,
+        )
+        try:
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+            self._sock.bind((0, UDEV_GROUP))
+
+            # events for uevents the kernel sent before now aren't ours
+            self._start = _seqnum()
+        except BaseException:
+            self._sock.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _exc_type, _exc_value, _traceback):
+        self.close()
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    @property
+    def active(self) -> bool:
+        return self._sock is not None
+
+    def wait(self, action: Optional[str], dev: int, timeout=DEFAULT_TIMEOUT) -> bool:
+        """
+        Waits for udev to finish processing a uevent with the given action,
+        or any action if None, for the device number 'dev'.  Returns False
+        if it times out.
+        """
+        if self._sock is None:
+            return True
+
+        major = str(os.major(dev))
+        minor = str(os.minor(dev))
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+
+            ready, _, _ = select.select([self._sock], [], [], remaining)
+            if not ready:
+                continue
+
+            e = parse_event(self._sock.recv(65536))
+            if e is None:
+                continue
+            if e.get("MAJOR") != major or e.get("MINOR") != minor:
+                continue
+            if int(e.get("SEQNUM", "0")) <= self._start:
+                continue
+            if action is None or e.get("ACTION") == action:
+                log.info(f"udev finished {e.get('ACTION')} of {e.get('DEVNAME')}")
+                return True
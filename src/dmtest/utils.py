@@ -1,3 +1,5 @@
+import dmtest.command_trace as command_trace
+import dmtest.geometry as geometry
 import dmtest.process as process
 import dmtest.units as units
 import logging as log
@@ -150,8 +152,25 @@ def wipe_device(dev, sectors=None):
 
 
 def dev_size(dev):
-    (_, stdout, _) = process.run(f"blockdev --getsz {_to_path(dev)}")
-    return int(stdout)
+    """
+    Size of a block device in sectors, as 'blockdev --getsz' gives.
+    Cached, see dmtest.geometry.
+    """
+    return geometry.geometry(_to_path(dev)).size
+
+
+def sync():
+    with command_trace.timed("sync", "sync"):
+        os.sync()
+
+
+def drop_caches(level=3):
+    """
+    1 drops the page cache, 2 dentries and inodes, 3 both.
+    """
+    with command_trace.timed("drop_caches", f"drop_caches {level}"):
+        with open("/proc/sys/vm/drop_caches", "w") as f:
+            f.write(f"{level}\n")
 
 
 @contextmanager
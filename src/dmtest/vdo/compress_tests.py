@@ -2,10 +2,9 @@ from dmtest.assertions import assert_equal, assert_near
 from dmtest.gendatablocks import make_block_range
 from dmtest.vdo.stats import vdo_stats
 from dmtest.vdo.utils import BLOCK_SIZE, MB, fsync, standard_vdo, wait_for_index
-import dmtest.process as process
 
 import logging as log
-import time
+import os
 
 def wait_until_packer_only(vdo):
     """Waits until all the I/Os being processed by a VDO device are
@@ -14,12 +13,20 @@ def wait_until_packer_only(vdo):
     Returns VDO stats collected after waiting. (dict, see vdo_stats)
 
     """
-    while True:
-        stats = vdo_stats(vdo)
+    # Push the buffered writes down to the VDO once; polling the stats
+    # doesn't need to sync again.
+    os.sync()
+
+    def packer_only():
+        stats = vdo_stats(vdo, sync=False)
         if stats['currentVIOsInProgress'] == stats['packer']['compressedFragmentsInPacker']:
             # We're done
             return stats
-        time.sleep(0.001)
+        return None
+
+    # The packer doesn't raise device-mapper events, so this is a plain
+    # poll of the stats message.
+    return vdo.wait_for(packer_only, interval=0.1)
 
 def t_compress(fix):
     size = 4 * MB
@@ -30,7 +37,6 @@ def t_compress(fix):
         range2 = make_block_range(path=vdo.path, block_size=BLOCK_SIZE,
                                   block_count=size_in_blocks,
                                   offset=size_in_blocks)
-        process.run("udevadm settle")
         stats = vdo_stats(vdo)
         assert_equal(stats['dataBlocksUsed'], 0, 'data blocks used (init)')
         assert_equal(stats['hashLock']['dedupeAdviceValid'], 0,
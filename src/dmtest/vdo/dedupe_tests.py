@@ -1,14 +1,11 @@
 from dmtest.assertions import assert_equal, assert_near
 from dmtest.vdo.utils import BLOCK_SIZE, standard_vdo, wait_for_index
 import dmtest.gendatablocks as generator
-import dmtest.process as process
 import dmtest.vdo.stats as stats
 
 def verify_dedupe(vdo, dedupe: float):
     # Wait for index to be online
     wait_for_index(vdo)
-    # Do our usual wait on udev
-    process.run("udevadm settle")
 
     # Get stats before any writing
     stats_pre = stats.vdo_stats(vdo)
@@ -79,7 +76,6 @@ def t_dedupeWithOffsetAndRestart(fix):
     with standard_vdo(fix, format=False) as vdo:
         range1.update_path(vdo.path)
         range2.update_path(vdo.path)
-        process.run("udevadm settle")
         # We don't care about waiting for the index if we're just
         # reading.
         range1.verify()
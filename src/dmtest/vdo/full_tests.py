@@ -1,13 +1,13 @@
 from dmtest.assertions import assert_equal
 import dmtest.device_mapper.dev as dmdev
 from dmtest.gendatablocks import make_block_range
-import dmtest.process as process
 import dmtest.tvm as tvm
 import dmtest.units as units
 import dmtest.vdo.stats as stats
 from dmtest.vdo.utils import MB, GB, populate_block_map
 import dmtest.vdo.vdo_stack as vs
 
+import errno
 import logging as log
 import time
 
@@ -71,30 +71,25 @@ def t_full(fix):
             # we verify.
             range5.trim()
             # Writing new data should fail
-            process.run("udevadm settle")
             gave_error = False
             try:
-                range5.write(tag="tag3", fsync=True)
+                # Direct I/O, so the error comes back from the write
+                # itself, rather than as EIO from a later fsync.
+                range5.write(tag="tag3", direct=True, fsync=True)
             except OSError as e:
-                # VDO should be generating ENOSPC errors here but what
-                # we get out is EIO from fsync. Getting back the
-                # ENOSPC to Python may require using direct I/O in
-                # gendatablocks, which isn't supported currently.
-                #
-                # For now, just expect some error to have come back.
                 gave_error = True
                 log.info(f"exception raised! {e}")
+                assert_equal(e.errno, errno.ENOSPC)
             if not gave_error:
                 raise AssertionError("writing new data to full VDO should fail")
             # The write failed, so range5 will not have updated its
             # idea of the data we should find there; it still expects
             # zero blocks.
-            process.run("udevadm settle")
-            range1.verify()
-            range2.verify()
-            range3.verify()
-            range4.verify()
-            range5.verify()
+            range1.verify(direct=True)
+            range2.verify(direct=True)
+            range3.verify(direct=True)
+            range4.verify(direct=True)
+            range5.verify(direct=True)
             # Free some space - discard some unique, some duplicated data
             range1.trim(fsync=True)
             new_stats = stats.vdo_stats(vdo)
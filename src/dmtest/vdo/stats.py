@@ -18,7 +18,8 @@ def make_delta_stats(stats_post, stats_pre):
         return stats_post - stats_pre
     return stats_post
 
-def vdo_stats(dev):
-    os.sync()
+def vdo_stats(dev, sync=True):
+    if sync:
+        os.sync()
     stats = dev.message(0, "stats");
     return _parse_vdo_stats(stats)
@@ -10,7 +10,6 @@ import logging as log
 from math import ceil
 import os
 import tempfile
-import time
 
 # dmtest.units.kilo etc count in sectors, not bytes
 kB = 1024
@@ -48,11 +47,12 @@ def standard_vdo(fix, **opts):
     return stack.activate()
 
 def wait_for_index(dev):
-    count = 0;
-    while (count < 30 and status.vdo_status(dev)["index-state"] != "online"):
-        count += 1
-        time.sleep(1)
-    if status.vdo_status(dev)["index-state"] != "online":
+    def online():
+        return status.vdo_status(dev).index_state == "online"
+
+    try:
+        dev.wait_for(online, timeout=30)
+    except TimeoutError:
         raise AssertionError("VDO not online within 30 seconds")
 
 def fsync(dev):